@@ -0,0 +1,40 @@
+"""Per-frame latency and memory of the freeswim tracker background engines
+
+Run from the repository root with
+    python -m benchmarks.background_engines
+"""
+import time
+import tracemalloc
+from typing import List
+
+import numpy as np
+
+from benchmarks import synthetic
+from plugins.freeswim import background
+
+frame_num = 300
+
+
+def measure_engine(engine: background.BackgroundModel, frames: List[np.ndarray]):
+    """Return per-frame latencies [ms], peak traced allocation [bytes] and model state size [bytes]"""
+    latencies = np.zeros(len(frames))
+    tracemalloc.start()
+    for i, frame in enumerate(frames):
+        t = time.perf_counter()
+        engine.apply(frame)
+        latencies[i] = (time.perf_counter() - t) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return latencies, peak, engine.nbytes
+
+
+if __name__ == '__main__':
+    # Downsampled footage keeps the frame stack in memory small
+    frames = [frame for frame, _ in synthetic.larvae_frames(frame_num, resolution=(540, 960))]
+
+    print(f'{"engine":>16} {"mean [ms]":>10} {"p50 [ms]":>9} {"p99 [ms]":>9} {"peak [MB]":>10} {"state [MB]":>11}')
+    for name in background.engines:
+        latencies, peak, nbytes = measure_engine(background.create(name), frames)
+        print(f'{name:>16} {latencies.mean():>10.2f} {np.percentile(latencies, 50):>9.2f} '
+              f'{np.percentile(latencies, 99):>9.2f} {peak / 2 ** 20:>10.1f} {nbytes / 2 ** 20:>11.1f}')
@@ -0,0 +1,95 @@
+"""Full-frame copies per frame of the previous and the current freeswim tracker frame path
+
+The previous path is the orientation handling and display frame creation of the old routine with a single analysis
+stage (threshold). The current path runs the frame path of FreeswimTrackerRoutine.main with the default frame_layout
+(height_width): display frame conversion, FreeswimTracker.process, pasting of the filtered and binary arena frames,
+ROI drawing and transposed writes into (w, h) attribute buffers. FreeswimTracker.process alone is given for reference.
+Frames are synthetic larvae footage, peak memory is measured with tracemalloc in units of one grayscale frame.
+
+Run from the repository root with
+    python -m benchmarks.frame_copies
+"""
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from benchmarks import synthetic
+from plugins.freeswim import tracker
+
+resolution = (1080, 1920)
+max_particle_number = 10
+warmup_frame_num = 100
+repeats = 100
+
+# Processing parameters of FreeswimTrackerRoutine
+params = SimpleNamespace(rect_size=(60, 60), max_particle_number=max_particle_number,
+                         dimension_size=np.array([100., 80.]), binary_thresh_val=25, min_area=10, filter_size=31,
+                         calibration_rect_pos=np.array([100, 100]), calibration_rect_size=np.array([1700, 880]),
+                         camera_calibration=None)
+frame_tracker = tracker.FreeswimTracker(resolution, params)
+
+# Full sized buffers of the routine
+display_buffer = np.zeros((*resolution, 3), dtype=np.uint8)
+filtered_buffer = np.zeros(resolution, dtype=np.uint8)
+binary_buffer = np.zeros(resolution, dtype=np.uint8)
+
+# Output attribute buffers in (width, height) layout, ArrayAttribute.write copies into them
+display_out = np.zeros((resolution[1], resolution[0], 3), dtype=np.uint8)
+filtered_out = np.zeros((resolution[1], resolution[0]), dtype=np.uint8)
+binary_out = np.zeros((resolution[1], resolution[0]), dtype=np.uint8)
+
+
+def previous_path(frame: np.ndarray):
+    frame = frame.T
+    display_frame = np.repeat(frame[:, :, np.newaxis], 3, axis=-1)
+    display_frame = cv2.rotate(cv2.flip(display_frame, 0), cv2.ROTATE_90_CLOCKWISE)
+    _, thresh_frame = cv2.threshold(frame, 25, 255, cv2.THRESH_BINARY)
+    binary_out[:] = thresh_frame
+    display_frame = cv2.flip(cv2.rotate(display_frame, cv2.ROTATE_90_COUNTERCLOCKWISE), 0)
+    display_out[:] = display_frame
+
+
+def current_path(frame: np.ndarray):
+    display_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB, dst=display_buffer)
+    particle_num = frame_tracker.process(frame)
+    filtered_out[:] = frame_tracker.detector.paste(frame_tracker.filtered_frame, filtered_buffer).T
+    binary_out[:] = frame_tracker.detector.paste(frame_tracker.binary_frame, binary_buffer).T
+    xdiff, ydiff = params.rect_size[0] // 2, params.rect_size[1] // 2
+    for x, y in frame_tracker.pixel_positions[:particle_num]:
+        cv2.rectangle(display_frame, [x - xdiff, y - ydiff], [x + xdiff, y + ydiff], (255, 0, 0), 2)
+    display_out[:] = display_frame.transpose(1, 0, 2)
+
+
+def process_only(frame: np.ndarray):
+    frame_tracker.process(frame)
+
+
+def measure(fun, frame: np.ndarray):
+    fun(frame)
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    fun(frame)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t = time.perf_counter()
+    for _ in range(repeats):
+        fun(frame)
+    return (time.perf_counter() - t) / repeats * 1000, (peak - base) / frame.nbytes
+
+
+if __name__ == '__main__':
+    scene = synthetic.LarvaeScene(max_particle_number, resolution, fish_size=(20, 6))
+    for _ in range(warmup_frame_num):
+        frame_tracker.process(scene.render())
+        scene.step()
+    camera_frame = scene.render()
+    print(f'{"path":>10} {"time [ms]":>10} {"peak [frames]":>14}')
+    for name, path in [('previous', previous_path), ('current', current_path), ('process', process_only)]:
+        ms, frames = measure(path, camera_frame)
+        print(f'{name:>10} {ms:>10.2f} {frames:>14.1f}')
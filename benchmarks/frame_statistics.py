@@ -0,0 +1,42 @@
+"""Per-frame cost of control camera frame statistics with separate NumPy calls and with the banded reducer
+
+Both compute sum, mean, max, number of saturated pixels and the block sums of a 4 x 4 grid.
+
+Run from the repository root with
+    python -m benchmarks.frame_statistics
+"""
+import time
+
+import numpy as np
+
+from plugins.common import frame_statistics
+
+grid_shape = (4, 4)
+repeats = 500
+
+
+def separate_calls(frame: np.ndarray) -> np.ndarray:
+    rows, cols = frame.shape[0] // grid_shape[0], frame.shape[1] // grid_shape[1]
+    block_sums = frame.reshape(grid_shape[0], rows, grid_shape[1], cols).sum(axis=(1, 3))
+    return np.array([frame.sum(), frame.mean(), frame.max(), np.count_nonzero(frame == 255), *block_sums.ravel()])
+
+
+def measure(fun, frame: np.ndarray):
+    t = time.perf_counter()
+    for _ in range(repeats):
+        values = fun(frame)
+    return (time.perf_counter() - t) / repeats * 1e6, values
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+
+    print(f'{"resolution":>11} {"separate [us]":>14} {"reducer [us]":>13} {"equal":>6}')
+    for resolution in [(480, 752), (1080, 1920), (2048, 2048)]:
+        frame = rng.integers(0, 256, resolution, dtype=np.uint8)
+        reducer = frame_statistics.FrameReducer(resolution, grid_shape)
+        separate_duration, separate_values = measure(separate_calls, frame)
+        reducer_duration, reducer_values = measure(reducer.apply, frame)
+        equal = np.allclose(separate_values, reducer_values)
+        print(f'{resolution[1]:>5}x{resolution[0]:<5} {separate_duration:>14.1f} {reducer_duration:>13.1f} '
+              f'{equal!s:>6}')
@@ -0,0 +1,84 @@
+"""Peak per-frame allocation of the freeswim tracker with and without preallocated buffers
+
+The previous output stage (display frame creation, ROI cropping and position mapping as FreeswimTrackerRoutine.main
+did it before) is compared with the output stage of FreeswimTracker (_update_particles and the display frame
+conversion of the routine) and with full frames through FreeswimTracker.process and its BlobDetector.
+Frames are synthetic larvae footage with max_particle_number fish.
+
+Run from the repository root with
+    python -m benchmarks.output_buffers
+"""
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from benchmarks import synthetic
+from plugins.freeswim import tracker
+
+resolution = (1080, 1920)
+max_particle_number = 10
+warmup_frame_num = 100
+
+# Processing parameters of FreeswimTrackerRoutine
+params = SimpleNamespace(rect_size=(60, 60), max_particle_number=max_particle_number,
+                         dimension_size=np.array([100., 80.]), binary_thresh_val=25, min_area=10, filter_size=31,
+                         calibration_rect_pos=np.array([100, 100]), calibration_rect_size=np.array([1700, 880]),
+                         camera_calibration=None)
+
+display_buffer = np.zeros((*resolution, 3), dtype=np.uint8)
+
+
+def previous_output(frame: np.ndarray, centroids: np.ndarray):
+    rect_size, dimension_size = params.rect_size, params.dimension_size
+    xdiff, ydiff = rect_size[0] // 2, rect_size[1] // 2
+    display_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+    new_rects = np.zeros((max_particle_number, *rect_size))
+    new_positions = -np.ones((max_particle_number, 2))
+    for k, (x, y) in enumerate(centroids):
+        p = np.array([x, y]).copy()
+        p = p - params.calibration_rect_pos
+        p = p / params.calibration_rect_size
+        p = p * dimension_size
+        p[1] = dimension_size[1] - p[1]
+        new_rects[k] = frame[y - ydiff:y + ydiff, x - xdiff:x + xdiff].T
+        new_positions[k] = p
+    return display_frame, new_rects, new_positions
+
+
+def peak_allocation(fun, *args) -> int:
+    fun(*args)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    fun(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - base
+
+
+if __name__ == '__main__':
+    scene = synthetic.LarvaeScene(max_particle_number, resolution, fish_size=(20, 6))
+    frame_tracker = tracker.FreeswimTracker(resolution, params)
+    for _ in range(warmup_frame_num):
+        frame_tracker.process(scene.render())
+        scene.step()
+    frame = scene.render()
+    particle_num = frame_tracker.process(frame)
+    centroids = frame_tracker.pixel_positions.copy()
+    track_ids = frame_tracker.particle_track_ids.copy()
+    print(f'{particle_num} particles detected in {resolution[1]}x{resolution[0]} frame '
+          f'({frame.nbytes / 1024:.0f} kB)')
+
+    def current_output():
+        cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB, dst=display_buffer)
+        frame_tracker._update_particles(frame, centroids, track_ids, time.perf_counter())
+
+    stages = [('previous output', lambda: previous_output(frame, centroids)),
+              ('current output', current_output),
+              ('detector.apply', lambda: frame_tracker.detector.apply(frame, params.filter_size,
+                                                                      params.binary_thresh_val)),
+              ('tracker.process', lambda: frame_tracker.process(frame))]
+    for name, stage in stages:
+        print(f'{name:>16}: peak allocation per frame {peak_allocation(stage) / 1024:.1f} kB')
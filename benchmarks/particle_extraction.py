@@ -0,0 +1,71 @@
+"""Per-frame cost of blob extraction against the number of contours in a binary frame
+
+Run from the repository root with
+    python -m benchmarks.particle_extraction
+"""
+import time
+
+import cv2
+import numpy as np
+
+from plugins.freeswim import particles
+
+resolution = (1080, 1920)
+min_area = 10
+max_particle_number = 10
+rect_size = (60, 60)
+repeats = 50
+
+
+def make_binary_frame(blob_num: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    frame = np.zeros(resolution, dtype=np.uint8)
+    for x, y, r in zip(rng.integers(0, resolution[1], blob_num),
+                       rng.integers(0, resolution[0], blob_num),
+                       rng.integers(1, 8, blob_num)):
+        cv2.circle(frame, (int(x), int(y)), int(r), 255, -1)
+    return frame
+
+
+def contour_loop(thresh_frame: np.ndarray):
+    """Previous per-contour implementation"""
+    contours, _ = cv2.findContours(thresh_frame, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    xdiff, ydiff = rect_size[0] // 2, rect_size[1] // 2
+    areas = []
+    for cnt in contours:
+        M = cv2.moments(cnt)
+        area = cv2.contourArea(cnt)
+        if area < min_area:
+            continue
+        centroid = np.array([int(M['m10'] / M['m00']), int(M['m01'] / M['m00'])])
+        rect = thresh_frame[centroid[1] - ydiff:centroid[1] + ydiff, centroid[0] - xdiff:centroid[0] + xdiff]
+        if rect.shape == rect_size:
+            areas.append((area, centroid))
+    return sorted(areas, key=lambda a: a[0])[::-1][:max_particle_number]
+
+
+def batched(thresh_frame: np.ndarray):
+    xdiff, ydiff = rect_size[0] // 2, rect_size[1] // 2
+    areas, centroids, _ = particles.detect_blobs(thresh_frame)
+    selected, _ = particles.select_particles(areas, centroids, min_area, max_particle_number,
+                                             lower_bound=np.array([xdiff, ydiff]),
+                                             upper_bound=np.array([thresh_frame.shape[1] - xdiff + 1,
+                                                                   thresh_frame.shape[0] - ydiff + 1]))
+    return [(areas[i], centroids[i].astype(int)) for i in selected]
+
+
+def time_per_frame(fun, frame: np.ndarray) -> float:
+    fun(frame)
+    t = time.perf_counter()
+    for _ in range(repeats):
+        fun(frame)
+    return (time.perf_counter() - t) / repeats * 1000
+
+
+if __name__ == '__main__':
+    print(f'{"blobs":>8} {"contours":>10} {"loop [ms]":>10} {"batched [ms]":>13}')
+    for blob_num in [1, 10, 100, 300, 1000, 3000]:
+        binary = make_binary_frame(blob_num)
+        contour_num = len(cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[0])
+        print(f'{blob_num:>8} {contour_num:>10} '
+              f'{time_per_frame(contour_loop, binary):>10.2f} {time_per_frame(batched, binary):>13.2f}')
@@ -0,0 +1,48 @@
+"""Throughput and detection recall of freeswim blob detection for different downsample factors
+
+Run from the repository root with
+    python -m benchmarks.pyramid_detection
+"""
+import time
+
+import numpy as np
+
+from benchmarks import synthetic
+from plugins.freeswim import detection, particles
+
+fish_num = 5
+warmup_frame_num = 100
+frame_num = 200
+filter_size = 31
+binary_thresh_val = 25
+min_area = 10
+rect_size = (60, 60)
+# Maximum distance [px] between detected and ground truth position to count as detection
+tolerance = 5.
+
+
+def run(factor: int):
+    detector = detection.BlobDetector((1080, 1920), factor)
+    duration = 0.
+    hits = 0
+    for i, (frame, truth) in enumerate(synthetic.larvae_frames(warmup_frame_num + frame_num, fish_num)):
+        t = time.perf_counter()
+        _, _, areas, centroids = detector.apply(frame, filter_size, binary_thresh_val)
+        selected, _ = particles.select_particles(areas, centroids, min_area, fish_num)
+        centroids = detector.refine_centroids(frame, centroids[selected], rect_size)
+        if i < warmup_frame_num:
+            continue
+        duration += time.perf_counter() - t
+
+        if centroids.shape[0] > 0:
+            distances = np.linalg.norm(truth[:, None, :] - centroids[None, :, :], axis=-1)
+            hits += np.count_nonzero(distances.min(axis=1) < tolerance)
+
+    return frame_num / duration, hits / (frame_num * fish_num)
+
+
+if __name__ == '__main__':
+    print(f'{"factor":>7} {"frames/s":>9} {"recall":>7}')
+    for factor in [1, 2, 4]:
+        fps, recall = run(factor)
+        print(f'{factor:>7} {fps:>9.1f} {recall:>7.3f}')
@@ -0,0 +1,61 @@
+"""Write throughput and compression ratio of ragged ROI crop storage for different HDF5 filters
+
+ROI crops are cut around the ground truth positions of synthetic larvae. Throughput is measured for writing
+the crops in the calling process (as the writing process of BackgroundRaggedWriter does), the ratio compares
+file size to the raw size of the crops. Blosc filters are only measured if hdf5plugin is installed.
+
+Run from the repository root with
+    python -m benchmarks.roi_compression
+"""
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from benchmarks import synthetic
+from plugins.freeswim import ragged
+
+fish_num = 3
+frame_num = 1000
+rect_size = (60, 60)
+
+codecs = {'none': {}, 'lzf': {'compression': 'lzf'}, 'gzip 1': {'compression': 'gzip', 'compression_opts': 1}}
+if ragged.hdf5plugin is not None:
+    codecs['blosc lz4'] = dict(ragged.hdf5plugin.Blosc(cname='lz4', clevel=5))
+    codecs['blosc zstd'] = dict(ragged.hdf5plugin.Blosc(cname='zstd', clevel=1))
+
+
+def crop_frames():
+    xdiff, ydiff = rect_size[0] // 2, rect_size[1] // 2
+    crops = []
+    for frame, positions in synthetic.larvae_frames(frame_num, fish_num, fish_size=(20, 6)):
+        positions = np.clip(positions.astype(int), (xdiff, ydiff), (frame.shape[1] - xdiff, frame.shape[0] - ydiff))
+        crops.append(np.stack([frame[y - ydiff:y + ydiff, x - xdiff:x + xdiff].T for x, y in positions]))
+    return crops
+
+
+def measure(crops, options, filepath):
+    t = time.perf_counter()
+    with h5py.File(filepath, 'w') as f:
+        writer = ragged.RaggedWriter(f, {'particle_rois': (rect_size, np.uint8)},
+                                     compressed_fields=['particle_rois'], compression=options)
+        for i, rois in enumerate(crops):
+            writer.append(i, particle_rois=rois)
+        writer.close()
+    duration = time.perf_counter() - t
+
+    raw_size = sum(rois.nbytes for rois in crops)
+    return raw_size / duration / 2 ** 20, raw_size / os.path.getsize(filepath)
+
+
+if __name__ == '__main__':
+    crops = crop_frames()
+    recording_rate = sum(rois.nbytes for rois in crops) / len(crops) * 115 / 2 ** 20
+    print(f'{fish_num} fish, raw ROI data rate at 115 fps: {recording_rate:.2f} MB/s')
+    print(f'{"codec":>12} {"write [MB/s]":>13} {"ratio":>6}')
+    with tempfile.TemporaryDirectory() as folder:
+        for name, options in codecs.items():
+            throughput, ratio = measure(crops, options, os.path.join(folder, 'rois.hdf5'))
+            print(f'{name:>12} {throughput:>13.1f} {ratio:>6.2f}')
@@ -0,0 +1,53 @@
+"""Per-frame cost of cutting ROIs with a slicing loop and with one batch gather, for different fish numbers
+
+The loop drops fish whose ROI is not fully enclosed by the frame, the batch gather pads them.
+
+Run from the repository root with
+    python -m benchmarks.roi_crop
+"""
+import time
+
+import numpy as np
+
+from plugins.freeswim import particles
+
+resolution = (1080, 1920)
+rect_size = (60, 60)
+repeats = 2000
+
+
+def crop_loop(frame: np.ndarray, centers: np.ndarray, out: np.ndarray) -> int:
+    xdiff, ydiff = rect_size[0] // 2, rect_size[1] // 2
+    k = 0
+    for x, y in centers:
+        rect = frame[y - ydiff:y + ydiff, x - xdiff:x + xdiff]
+        if rect.shape != rect_size[::-1]:
+            continue
+        out[k] = rect.T
+        k += 1
+    return k
+
+
+def crop_batch(frame: np.ndarray, centers: np.ndarray, out: np.ndarray) -> int:
+    return particles.crop_rois(frame, centers, rect_size, out).shape[0]
+
+
+def measure(crop, frame: np.ndarray, centers: np.ndarray, out: np.ndarray):
+    t = time.perf_counter()
+    for _ in range(repeats):
+        count = crop(frame, centers, out)
+    return (time.perf_counter() - t) / repeats * 1e6, count
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(1)
+    frame = rng.integers(0, 256, resolution, dtype=np.uint8)
+
+    print(f'{"fish":>5} {"loop [us]":>10} {"batch [us]":>11} {"loop kept":>10} {"batch kept":>11}')
+    for fish_num in [1, 3, 10, 30, 100]:
+        # Some fish are placed close to the frame edge
+        centers = rng.integers((0, 0), (resolution[1], resolution[0]), (fish_num, 2))
+        out = np.zeros((fish_num, *rect_size), dtype=np.uint8)
+        loop_duration, loop_count = measure(crop_loop, frame, centers, out)
+        batch_duration, batch_count = measure(crop_batch, frame, centers, out)
+        print(f'{fish_num:>5} {loop_duration:>10.1f} {batch_duration:>11.1f} {loop_count:>10} {batch_count:>11}')
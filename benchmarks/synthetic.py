@@ -0,0 +1,95 @@
+"""Synthetic footage of dark larvae moving on a bright background with known ground truth positions"""
+from typing import Iterator, Tuple
+
+import cv2
+import numpy as np
+
+
+class LarvaeScene:
+    """Dark ellipses on a bright background, moving as a random walk with reflection at the frame borders
+
+    Defaults match the multiple_fish_vertical_swim camera (1920x1080 at 115 fps). Optionally the scene
+    contains sensor noise, a slow sinusoidal drift of illumination (with a horizontal gradient, as from a
+    single light source) and static occluders in front of the fish, which hide them from the camera.
+    """
+
+    def __init__(self, fish_num: int = 5, resolution: Tuple[int, int] = (1080, 1920), fps: float = 115.,
+                 fish_size: Tuple[int, int] = (12, 4), speed: float = 345., noise: float = 4.,
+                 illumination_drift: float = 0., drift_period: float = 20., occluder_num: int = 0,
+                 occluder_size: Tuple[int, int] = (40, 240), seed: int = 1):
+        self.rng = np.random.default_rng(seed)
+        self.fish_num = fish_num
+        self.resolution = resolution
+        self.fps = fps
+        self.fish_size = fish_size
+        # Swimming speed [px/s]
+        self.speed = speed
+        self.noise = noise
+        # Relative amplitude of illumination changes and their period [s]
+        self.illumination_drift = illumination_drift
+        self.drift_period = drift_period
+
+        height, width = resolution
+        self.margin = 2 * max(fish_size)
+        self.positions = self.rng.uniform((self.margin, self.margin), (width - self.margin, height - self.margin),
+                                          (fish_num, 2))
+        self.headings = self.rng.uniform(0, 2 * np.pi, fish_num)
+        self.frame_index = 0
+
+        # Occluders as (x0, y0, x1, y1) rectangles
+        pos = self.rng.uniform((0, 0), (width - occluder_size[0], height - occluder_size[1]), (occluder_num, 2))
+        self.occluders = np.concatenate([pos, pos + occluder_size], axis=1).astype(int)
+
+        self.background = np.full(resolution, 200, dtype=np.uint8)
+        self._gradient = np.linspace(-1., 1., width, dtype=np.float32)[None, :]
+
+    @property
+    def visible(self) -> np.ndarray:
+        """Mask of fish whose center is not hidden by an occluder"""
+        x, y = self.positions[:, 0, None], self.positions[:, 1, None]
+        x0, y0, x1, y1 = self.occluders.T
+        return ~np.any((x >= x0) & (x < x1) & (y >= y0) & (y < y1), axis=1)
+
+    def step(self):
+        height, width = self.resolution
+        upper = np.array([width, height]) - self.margin
+
+        self.headings += self.rng.normal(0, 0.2, self.fish_num)
+        self.positions += self.speed / self.fps * np.stack([np.cos(self.headings), np.sin(self.headings)], axis=1)
+        outside = (self.positions < self.margin) | (self.positions > upper)
+        self.headings[outside[:, 0]] = np.pi - self.headings[outside[:, 0]]
+        self.headings[outside[:, 1]] = -self.headings[outside[:, 1]]
+        self.positions = np.clip(self.positions, self.margin, upper)
+        self.frame_index += 1
+
+    def render(self) -> np.ndarray:
+        frame = self.background.copy()
+        for (x, y), heading in zip(self.positions, self.headings):
+            cv2.ellipse(frame, (int(round(x)), int(round(y))), self.fish_size, np.rad2deg(heading), 0, 360, 40, -1)
+        for x0, y0, x1, y1 in self.occluders:
+            cv2.rectangle(frame, (x0, y0), (x1, y1), 150, -1)
+
+        if self.illumination_drift == 0 and self.noise == 0:
+            return frame
+
+        image = frame.astype(np.float32)
+        if self.illumination_drift > 0:
+            phase = 2 * np.pi * self.frame_index / (self.fps * self.drift_period)
+            image *= 1. + self.illumination_drift * (np.sin(phase) + 0.5 * np.cos(phase) * self._gradient)
+        if self.noise > 0:
+            image += self.rng.normal(0, self.noise, self.resolution)
+
+        return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def larvae_frames(frame_num: int, fish_num: int = 5, resolution: Tuple[int, int] = (1080, 1920),
+                  fish_size: Tuple[int, int] = (12, 4), speed: float = 345., noise: float = 4., seed: int = 1,
+                  **kwargs) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yield (height, width) uint8 frames and (fish_num, 2) ground truth (x, y) positions
+
+    Further keyword arguments are passed on to LarvaeScene.
+    """
+    scene = LarvaeScene(fish_num, resolution, fish_size=fish_size, speed=speed, noise=noise, seed=seed, **kwargs)
+    for _ in range(frame_num):
+        scene.step()
+        yield scene.render(), scene.positions.copy()
@@ -0,0 +1,38 @@
+"""Throughput of freeswim blob detection with tile-parallel processing from 1 to N threads
+
+Run from the repository root with
+    python -m benchmarks.tile_scaling [max_thread_num]
+"""
+import os
+import sys
+import time
+
+from benchmarks import synthetic
+from plugins.freeswim import detection
+
+frame_num = 200
+filter_size = 31
+binary_thresh_val = 25
+
+
+def run(thread_num: int, frames) -> float:
+    detector = detection.BlobDetector((1080, 1920), thread_num=thread_num)
+    t = time.perf_counter()
+    for frame in frames:
+        detector.apply(frame, filter_size, binary_thresh_val)
+    duration = time.perf_counter() - t
+    detector.set_thread_num(1)
+
+    return len(frames) / duration
+
+
+if __name__ == '__main__':
+    max_thread_num = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    frames = [frame for frame, _ in synthetic.larvae_frames(frame_num)]
+
+    print(f'{"threads":>8} {"frames/s":>9} {"speedup":>8}')
+    baseline = None
+    for thread_num in range(1, max_thread_num + 1):
+        fps = run(thread_num, frames)
+        baseline = baseline or fps
+        print(f'{thread_num:>8} {fps:>9.1f} {fps / baseline:>8.2f}')
@@ -0,0 +1,120 @@
+"""Throughput, per-stage latency and detection accuracy of the freeswim tracker and ParticleDetection
+
+Both are run on synthetic footage of the multiple_fish_vertical_swim camera (1920x1080 at 115 fps) for a set of
+scenarios with increasing difficulty. Frames are rendered outside of the timed section. A detection is correct
+if it lies within tolerance of a visible fish, matched one to one; hidden fish are not counted as misses.
+
+Run from the repository root with
+    python -m benchmarks.tracker_suite
+"""
+import time
+from types import SimpleNamespace
+from typing import Dict
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from benchmarks import synthetic
+from plugins.common import contours
+from plugins.freeswim import tracker
+
+resolution = (1080, 1920)
+fps = 115.
+fish_num = 10
+warmup_frame_num = 150
+frame_num = 500
+# Maximum distance [px] between detected and ground truth position to count as detection
+tolerance = 5.
+# Larger than the default, so that fish pass the area limit of ParticleDetection
+fish_size = (20, 6)
+
+scenarios = {
+    'clean': dict(noise=0.),
+    'noise': dict(noise=8.),
+    'illumination drift': dict(noise=4., illumination_drift=0.15, drift_period=2.),
+    'occlusions': dict(noise=4., occluder_num=6),
+}
+
+# Processing parameters of FreeswimTrackerRoutine
+tracker_parameters = SimpleNamespace(rect_size=(60, 60), max_particle_number=fish_num,
+                                     dimension_size=np.array([100., 80.]), binary_thresh_val=25, min_area=10,
+                                     filter_size=31, calibration_rect_pos=np.array([0, 0]),
+                                     calibration_rect_size=np.array([1, 1]), camera_calibration=None)
+
+
+def match(detections: np.ndarray, truth: np.ndarray) -> int:
+    """Return number of one to one matches within tolerance"""
+    if detections.shape[0] == 0 or truth.shape[0] == 0:
+        return 0
+    cost = np.linalg.norm(truth[:, None, :] - detections[None, :, :], axis=-1)
+    rows, cols = linear_sum_assignment(cost)
+    return int(np.count_nonzero(cost[rows, cols] <= tolerance))
+
+
+def run(scenario: Dict, detect) -> Dict:
+    """Run detect(frame) -> (latency [ms], stage durations [ms], (N, 2) positions) on scenario"""
+    scene = synthetic.LarvaeScene(fish_num, resolution, fps, fish_size=fish_size, **scenario)
+    latencies = []
+    stage_durations = []
+    true_positives = detected = relevant = 0
+
+    for i in range(warmup_frame_num + frame_num):
+        scene.step()
+        frame = scene.render()
+        latency, durations, positions = detect(frame)
+        if i < warmup_frame_num:
+            continue
+
+        latencies.append(latency)
+        stage_durations.append(durations.copy())
+        truth = scene.positions[scene.visible]
+        true_positives += match(positions, truth)
+        detected += positions.shape[0]
+        relevant += truth.shape[0]
+
+    return {'latencies': np.array(latencies), 'stage_durations': np.array(stage_durations),
+            'precision': true_positives / max(detected, 1), 'recall': true_positives / max(relevant, 1)}
+
+
+def freeswim_tracker():
+    frame_tracker = tracker.FreeswimTracker(resolution, tracker_parameters)
+
+    def detect(frame: np.ndarray):
+        t = time.perf_counter()
+        frame_tracker.process(frame)
+        latency = (time.perf_counter() - t) * 1000
+        return latency, frame_tracker.stage_durations, frame_tracker.pixel_positions
+
+    return frame_tracker.stage_names, detect
+
+
+def particle_detection():
+    detector = contours.ContourDetector()
+
+    def detect(frame: np.ndarray):
+        t = time.perf_counter()
+        particle_contours = detector.apply(frame)
+        latency = (time.perf_counter() - t) * 1000
+        return latency, detector.stage_durations, contours.centroids(particle_contours)
+
+    return detector.stage_names, detect
+
+
+def report(name: str, stage_names, result: Dict):
+    latencies = result['latencies']
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f'  {name:>20} {1000 / latencies.mean():>9.1f} {p50:>9.2f} {p99:>9.2f} '
+          f'{result["precision"]:>10.3f} {result["recall"]:>7.3f}')
+    for stage, durations in zip(stage_names, result['stage_durations'].T):
+        s50, s99 = np.percentile(durations, [50, 99])
+        print(f'  {"- " + stage:>20} {"":>9} {s50:>9.2f} {s99:>9.2f}')
+
+
+if __name__ == '__main__':
+    print(f'{fish_num} fish at {resolution[1]}x{resolution[0]}, frame budget at {fps:.0f} fps: {1000 / fps:.1f} ms')
+    for scenario_name, scenario in scenarios.items():
+        print(f'\n{scenario_name}')
+        print(f'  {"":>20} {"frames/s":>9} {"p50 [ms]":>9} {"p99 [ms]":>9} {"precision":>10} {"recall":>7}')
+        for name, create in [('FreeswimTracker', freeswim_tracker), ('ParticleDetection', particle_detection)]:
+            stage_names, detect = create()
+            report(name, stage_names, run(scenario, detect))
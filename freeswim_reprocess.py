@@ -0,0 +1,216 @@
+"""Offline reprocessing of recorded freeswim frames with the analysis of FreeswimTrackerRoutine
+
+Frames are read from an HDF5 frame dataset (e.g. a camera attribute of a vxPy recording) or a video file.
+Long recordings are split into chunks which are processed in parallel. Every chunk starts overlap frames
+early, so that the background model has warmed up when the first frame of the chunk is reached.
+Particle attributes are written to a new HDF5 file under the same names as in the recording.
+
+Track ids are unique within the whole output, but tracks are not linked across chunk boundaries.
+
+Example:
+    python freeswim_reprocess.py recordings/2026-01-01-12-00-00/Camera.hdf5
+        --dataset multiple_fish_vertical_swim_frame --binary-thresh-val 30 --output results.hdf5
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Dict, Iterator, Tuple
+
+import cv2
+import h5py
+import numpy as np
+
+from plugins.freeswim import background, calibration, tracker
+
+# Attributes written by FreeswimTrackerRoutine which are reproduced offline
+attribute_names = ['particle_count_total', 'particle_count_filtered', 'particle_rois', 'particle_mapped_position',
+                   'particle_tracks', 'particle_track_ids']
+
+# Id offset between chunks (ids start at 1 in every chunk)
+chunk_id_offset = 2 ** 32
+
+
+def is_video(filepath: str) -> bool:
+    return os.path.splitext(filepath)[1].lower() not in ('.hdf5', '.h5')
+
+
+def frame_info(args) -> Tuple[int, Tuple[int, int]]:
+    """Return number of frames and (height, width) frame shape of input"""
+    if is_video(args.input):
+        capture = cv2.VideoCapture(args.input)
+        shape = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_num = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        return frame_num, shape
+
+    with h5py.File(args.input, 'r') as f:
+        dataset = f[args.dataset]
+        shape = dataset.shape[1:3]
+        frame_num = dataset.shape[0]
+    if args.frame_layout == 'width_height':
+        shape = shape[::-1]
+    return frame_num, shape
+
+
+def read_frames(args, start: int, stop: int) -> Iterator[np.ndarray]:
+    """Yield (height, width) grayscale frames start to stop of input"""
+    if is_video(args.input):
+        capture = cv2.VideoCapture(args.input)
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for _ in range(start, stop):
+            success, frame = capture.read()
+            if not success:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim > 2 else frame
+        capture.release()
+        return
+
+    with h5py.File(args.input, 'r') as f:
+        dataset = f[args.dataset]
+        # Read in blocks, single frame reads are slow on chunked datasets
+        for block_start in range(start, stop, args.read_block_size):
+            block = dataset[block_start:min(block_start + args.read_block_size, stop)]
+            for frame in block:
+                if frame.ndim > 2:
+                    frame = frame[:, :, 0]
+                if args.frame_layout == 'width_height':
+                    frame = frame.T
+                yield frame
+
+
+def create_parameters(args) -> SimpleNamespace:
+    # Processing parameters as read by the tracker from FreeswimTrackerRoutine
+    return SimpleNamespace(rect_size=tuple(args.rect_size),
+                           max_particle_number=args.max_particle_number,
+                           dimension_size=np.array(args.dimension_size, dtype=np.float64),
+                           binary_thresh_val=args.binary_thresh_val,
+                           min_area=args.min_area,
+                           filter_size=args.filter_size // 2 * 2 + 1,
+                           calibration_rect_pos=np.array(args.calibration_rect_pos),
+                           calibration_rect_size=np.array(args.calibration_rect_size),
+                           camera_calibration=calibration.load(args.camera_calibration)
+                           if args.camera_calibration else None)
+
+
+def attribute_specs(params, frame_num: int) -> Dict[str, Tuple[tuple, np.dtype, float]]:
+    """Return shape, dtype and fill value of every particle attribute for frame_num frames"""
+    n = params.max_particle_number
+    return {'particle_count_total': ((frame_num, 1), np.uint64, 0),
+            'particle_count_filtered': ((frame_num, 1), np.uint64, 0),
+            'particle_rois': ((frame_num, n, *params.rect_size), np.uint8, 0),
+            'particle_mapped_position': ((frame_num, n, 2), np.float64, -1),
+            'particle_tracks': ((frame_num, n, 2), np.float64, -1),
+            'particle_track_ids': ((frame_num, n), np.uint64, 0)}
+
+
+def create_buffers(params, frame_num: int) -> Dict[str, np.ndarray]:
+    return {name: np.full(shape, fill, dtype=dtype) for name, (shape, dtype, fill) in
+            attribute_specs(params, frame_num).items()}
+
+
+def process_chunk(args, shape: Tuple[int, int], chunk_index: int, start: int, stop: int) \
+        -> Tuple[int, Dict[str, np.ndarray]]:
+    """Process frames start to stop and return the particle attributes for them"""
+    # Parallelism comes from the process pool
+    cv2.setNumThreads(1)
+
+    params = create_parameters(args)
+    frame_tracker = tracker.FreeswimTracker(shape, params, args.downsample_factor, args.background_engine,
+                                            track_max_distance=args.track_max_distance,
+                                            track_max_missed=args.track_max_missed)
+    if args.arena_mode == 'rectangle':
+        frame_tracker.detector.arena.set_rectangle(params.calibration_rect_pos, params.calibration_rect_size)
+        frame_tracker.detector.reset_background()
+
+    results = create_buffers(params, stop - start)
+    warmup_start = max(start - args.overlap, 0)
+    for i, frame in enumerate(read_frames(args, warmup_start, stop), start=warmup_start):
+        frame_tracker.process(frame)
+        if i < start:
+            continue
+
+        # Warm-up frames also initialize the tracks, so ids are only made unique after the overlap
+        k = i - start
+        results['particle_count_total'][k] = frame_tracker.count_total
+        results['particle_count_filtered'][k] = frame_tracker.count_filtered
+        results['particle_rois'][k] = frame_tracker.padded_rois
+        results['particle_mapped_position'][k] = frame_tracker.padded_positions
+        results['particle_tracks'][k] = frame_tracker.tracks
+        results['particle_track_ids'][k] = frame_tracker.identity_tracker.ids
+
+    ids = results['particle_track_ids']
+    ids[ids > 0] += np.uint64(chunk_index * chunk_id_offset)
+
+    return start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reprocess recorded freeswim frames with new tracker parameters')
+    parser.add_argument('input', help='HDF5 file or video file')
+    parser.add_argument('--dataset', default='multiple_fish_vertical_swim_frame',
+                        help='Frame dataset in HDF5 input')
+    parser.add_argument('--frame-layout', choices=['width_height', 'height_width'], default='height_width',
+                        help='Layout of frames in HDF5 input (videos are always height_width)')
+    parser.add_argument('--output', help='Results file (default: <input>_reprocessed.hdf5)')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Frames per chunk')
+    parser.add_argument('--overlap', type=int, default=400,
+                        help='Frames processed before each chunk to warm up the background model')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes')
+    parser.add_argument('--read-block-size', type=int, default=64, help='Frames per read from HDF5 input')
+
+    # Processing parameters (defaults of FreeswimTrackerRoutine)
+    parser.add_argument('--binary-thresh-val', type=int, default=25)
+    parser.add_argument('--filter-size', type=int, default=31)
+    parser.add_argument('--min-area', type=int, default=10)
+    parser.add_argument('--max-particle-number', type=int, default=10)
+    parser.add_argument('--rect-size', type=int, nargs=2, default=[60, 60])
+    parser.add_argument('--dimension-size', type=float, nargs=2, default=[100., 80.], help='Arena size [mm]')
+    parser.add_argument('--calibration-rect-pos', type=float, nargs=2, default=[0, 0])
+    parser.add_argument('--calibration-rect-size', type=float, nargs=2, default=[1, 1])
+    parser.add_argument('--camera-calibration',
+                        help='Camera calibration (<calibration>_freeswim_camera.yaml), overrides rectangle scaling')
+    parser.add_argument('--arena-mode', choices=['full', 'rectangle'], default='full')
+    parser.add_argument('--downsample-factor', type=int, default=1)
+    parser.add_argument('--background-engine', choices=list(background.engines), default='mog2')
+    parser.add_argument('--track-max-distance', type=float, default=50.)
+    parser.add_argument('--track-max-missed', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.output is None:
+        args.output = f'{os.path.splitext(args.input)[0]}_reprocessed.hdf5'
+    if is_video(args.input):
+        args.frame_layout = 'height_width'
+
+    frame_num, frame_shape = frame_info(args)
+    bounds = list(range(0, frame_num, args.chunk_size)) + [frame_num]
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+    print(f'Process {frame_num} frames of shape {frame_shape} in {len(chunks)} chunks')
+
+    params = create_parameters(args)
+    start_time = time.perf_counter()
+    with h5py.File(args.output, 'w') as out_file, ProcessPoolExecutor(args.workers) as executor:
+        # Store all arguments to be able to reproduce the results
+        for key, value in vars(args).items():
+            if value is not None:
+                out_file.attrs[key] = value
+
+        for name, (shape, dtype, fill) in attribute_specs(params, frame_num).items():
+            out_file.create_dataset(name, shape=shape, dtype=dtype, fillvalue=fill,
+                                    chunks=(min(args.chunk_size, max(frame_num, 1)), *shape[1:]))
+
+        futures = [executor.submit(process_chunk, args, frame_shape, i, start, stop)
+                   for i, (start, stop) in enumerate(chunks)]
+        for future in futures:
+            start, results = future.result()
+            for name in attribute_names:
+                out_file[name][start:start + results[name].shape[0]] = results[name]
+            print(f'Frames {start} to {start + results[attribute_names[0]].shape[0]} done')
+
+    duration = time.perf_counter() - start_time
+    print(f'Wrote {args.output} in {duration:.1f} s ({frame_num / max(duration, 1e-9):.1f} fps)')
+
+
+if __name__ == '__main__':
+    main()
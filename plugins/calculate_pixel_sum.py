@@ -24,11 +24,22 @@ from vxpy.api.attribute import ArrayAttribute, ArrayType, read_attribute
 from vxpy.api.dependency import require_camera_device
 from vxpy.api.routine import CameraRoutine
 from vxpy.api import ui
+import vxpy.core.logger as vxlogger
+
+from plugins.common import frame_statistics, timing
+
+log = vxlogger.getLogger(__name__)
 
 
 class CalculateControlCamPixelSum(CameraRoutine):
 
     camera_id = 'faraday_control_cam'
+    # Frame statistics: grid (rows, columns) and saturation level (see plugins.common.frame_statistics.FrameReducer)
+    grid_shape = (4, 4)
+    saturation_level = 255
+    # Per-stage wall time [ms] in control_cam_pixel_sum_timing_<stage> (see plugins.common.timing.StageTimer)
+    timing_enabled = False
+    timing_window = 1000
 
     def __init__(self, *args, **kwargs):
         CameraRoutine.__init__(self, *args, **kwargs)
@@ -39,12 +50,31 @@ class CalculateControlCamPixelSum(CameraRoutine):
     def setup(self):
         # Create an array attribute to store output image in
         self.camera_pixel_sum = ArrayAttribute('control_cam_pixel_sum', (1, ), ArrayType.uint64)
+        statistic_num = len(frame_statistics.statistic_names) + self.grid_shape[0] * self.grid_shape[1]
+        self.camera_pixel_statistics = ArrayAttribute('control_cam_pixel_statistics', (statistic_num,),
+                                                      ArrayType.float64)
+        # Created for the shape of the first frame
+        self.reducer = None
+
+        # Stage timing
+        self.timer = timing.StageTimer(('reduce', 'write'), self.timing_window)
+        self.timing_attributes = [ArrayAttribute(f'control_cam_pixel_sum_timing_{name}', (1,), ArrayType.float32)
+                                  for name in self.timer.stage_names]
 
     def initialize(self):
         # Mark output array attribute as something to be written to file
         self.camera_pixel_sum.add_to_file()
+        self.camera_pixel_statistics.add_to_file()
         ui.register_with_plotter('control_cam_pixel_sum')
 
+        self.exposed.append(CalculateControlCamPixelSum.set_timing_enabled)
+        for attribute in self.timing_attributes:
+            ui.register_with_plotter(attribute.name, axis='control_cam_pixel_sum_timing')
+            attribute.add_to_file()
+
+    def set_timing_enabled(self, value):
+        self.timing_enabled = bool(value)
+
     def main(self, *args, **frames):
         # Read frame
         frame = frames.get(self.camera_id)
@@ -52,5 +82,20 @@ class CalculateControlCamPixelSum(CameraRoutine):
         # Make sure there is a frame
         if frame is None:
             return
-        # Write frame with drawn contours to attribute
-        self.camera_pixel_sum.write(frame.sum())
+        if self.timing_enabled:
+            self.timer.start()
+
+        # Calculate all statistics band by band
+        if self.reducer is None or self.reducer.frame_shape != frame.shape[:2]:
+            self.reducer = frame_statistics.FrameReducer(frame.shape[:2], self.grid_shape, self.saturation_level)
+        values = self.reducer.apply(frame)
+        if self.timing_enabled:
+            self.timer.lap(0)
+
+        # Write statistics to attributes
+        self.camera_pixel_sum.write(int(values[0]))
+        self.camera_pixel_statistics.write(values)
+
+        if self.timing_enabled:
+            self.timer.finish(self.timing_attributes, log)
+
@@ -0,0 +1,131 @@
+import time
+from typing import List
+
+import cv2
+import numpy as np
+
+
+class ContourDetector:
+    """Contours of dark particles on a bright background, as detected by ParticleDetection"""
+
+    # Processing stages, durations [ms] of the last processed frame are kept in stage_durations
+    stage_names = ('threshold', 'contours', 'filter')
+
+    def __init__(self, thresh_val: int = 70, min_area: float = 300.):
+        self.thresh_val = thresh_val
+        self.min_area = min_area
+        self.stage_durations = np.zeros(len(self.stage_names), dtype=np.float64)
+        self._thresh_buffer = None
+
+    def apply(self, frame: np.ndarray) -> List[np.ndarray]:
+        """Return contours of all dark particles larger than min_area in grayscale frame"""
+        t0 = time.perf_counter()
+
+        # Apply inv. threshold (filter for dark particles)
+        if self._thresh_buffer is None or self._thresh_buffer.shape != frame.shape:
+            self._thresh_buffer = np.zeros_like(frame)
+        cv2.threshold(frame, self.thresh_val, 255, cv2.THRESH_BINARY_INV, dst=self._thresh_buffer)
+        t1 = time.perf_counter()
+
+        contours, _ = cv2.findContours(self._thresh_buffer, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        t2 = time.perf_counter()
+
+        # Filter contours for minimum area size
+        contours = [cnt for cnt in contours if cv2.contourArea(cnt) > self.min_area]
+        t3 = time.perf_counter()
+
+        self.stage_durations[:] = np.diff([t0, t1, t2, t3]) * 1000
+        return contours
+
+
+class AdaptiveThreshold:
+    """Threshold of dark particles estimated from a running intensity histogram
+
+    The histogram is updated from every stride-th pixel (in both axes) of a frame and smoothed exponentially over
+    updates. The threshold is either Otsu's threshold of the histogram ('otsu') or the intensity below which
+    the given percentile of pixels lies ('percentile').
+    """
+
+    methods = ('otsu', 'percentile')
+
+    def __init__(self, method: str = 'otsu', percentile: float = 5., stride: int = 4, smoothing: float = 0.2):
+        if method not in self.methods:
+            raise ValueError(f'Unknown threshold method {method}, available: {self.methods}')
+        self.method = method
+        self.percentile = percentile
+        self.stride = stride
+        self.smoothing = smoothing
+        self.histogram = None
+        self.thresh_val = None
+
+    def reset(self):
+        self.histogram = None
+        self.thresh_val = None
+
+    def update(self, frame: np.ndarray) -> int:
+        """Add subsampled uint8 frame to the histogram and return the new threshold"""
+        counts = np.bincount(frame[::self.stride, ::self.stride].ravel(), minlength=256).astype(np.float64)
+        counts /= counts.sum()
+        if self.histogram is None:
+            self.histogram = counts
+        else:
+            self.histogram *= 1. - self.smoothing
+            self.histogram += self.smoothing * counts
+
+        if self.method == 'otsu':
+            self.thresh_val = otsu_threshold(self.histogram)
+        else:
+            cdf = np.cumsum(self.histogram)
+            self.thresh_val = int(np.searchsorted(cdf, self.percentile / 100. * cdf[-1]))
+        return self.thresh_val
+
+
+def otsu_threshold(histogram: np.ndarray) -> int:
+    """Return the intensity which maximizes the between-class variance of histogram"""
+    p = histogram / histogram.sum()
+    omega = np.cumsum(p)
+    mu = np.cumsum(p * np.arange(p.shape[0]))
+    # Both classes need to be non-empty
+    valid = (omega > 1e-9) & (omega < 1. - 1e-9)
+    variance = np.zeros_like(p)
+    variance[valid] = (mu[-1] * omega[valid] - mu[valid]) ** 2 / (omega[valid] * (1. - omega[valid]))
+    return int(np.argmax(variance))
+
+
+def centroids(contours: List[np.ndarray]) -> np.ndarray:
+    """Return (N, 2) (x, y) centroids of contours"""
+    points = np.zeros((len(contours), 2))
+    for k, cnt in enumerate(contours):
+        M = cv2.moments(cnt)
+        if M['m00'] > 0:
+            points[k] = M['m10'] / M['m00'], M['m01'] / M['m00']
+        else:
+            points[k] = cnt[:, 0].mean(axis=0)
+    return points
+
+
+def pack(contours: List[np.ndarray], vertices: np.ndarray, vertex_counts: np.ndarray, areas: np.ndarray,
+         centroid_out: np.ndarray, epsilon: float = 1.5) -> int:
+    """Write simplified polygons of contours into fixed size arrays and return the number of written contours
+
+    vertices (M, V, 2) receives the (x, y) polygon vertices, vertex_counts (M,) their number, areas (M,) the contour
+    areas and centroid_out (M, 2) the (x, y) centroids. Polygons are simplified with a tolerance of epsilon pixels
+    and evenly subsampled if they still have more than V vertices. Contours beyond M are dropped.
+    """
+    count = min(len(contours), vertices.shape[0])
+    max_vertices = vertices.shape[1]
+    for k, cnt in enumerate(contours[:count]):
+        polygon = cv2.approxPolyDP(cnt, epsilon, True)[:, 0]
+        if polygon.shape[0] > max_vertices:
+            polygon = polygon[np.linspace(0, polygon.shape[0], max_vertices, endpoint=False).astype(int)]
+        vertices[k, :polygon.shape[0]] = polygon
+        vertex_counts[k] = polygon.shape[0]
+        areas[k] = cv2.contourArea(cnt)
+    centroid_out[:count] = centroids(contours[:count])
+
+    # Clear unused rows
+    vertex_counts[count:] = 0
+    areas[count:] = 0
+    centroid_out[count:] = -1
+
+    return count
@@ -0,0 +1,75 @@
+import time
+from typing import Tuple
+
+import numpy as np
+import pyqtgraph as pg
+
+
+def downsample(frame: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Return a strided view of frame which is not smaller than size along its first two axes
+
+    Frames are shown with their first axis along the screen's x axis, so size is the (width, height) of the view
+    in screen pixels.
+    """
+    step = min(frame.shape[0] // max(size[0], 1), frame.shape[1] // max(size[1], 1))
+    if step <= 1:
+        return frame
+    return frame[::step, ::step]
+
+
+def screen_size(view_box, shape: Tuple[int, ...]) -> Tuple[int, int]:
+    """(width, height) in screen pixels which an image of shape covers in pyqtgraph view_box at the current zoom"""
+    (x0, x1), (y0, y1) = view_box.viewRange()
+    return (int(shape[0] * view_box.width() / max(x1 - x0, 1e-9)),
+            int(shape[1] * view_box.height() / max(y1 - y0, 1e-9)))
+
+
+class FrameTimeMeter:
+    """Smoothed duration [ms] of GUI updates which uploaded a new image and fraction of polls without new data"""
+
+    def __init__(self, smoothing: float = 0.9):
+        self.smoothing = smoothing
+        self.duration = 0.
+        self.max_duration = 0.
+        self.poll_num = 0
+        self.update_num = 0
+        self._start = 0.
+
+    def start(self):
+        self.poll_num += 1
+        self._start = time.perf_counter()
+
+    def stop(self):
+        """Mark the end of an update which uploaded a new image"""
+        duration = (time.perf_counter() - self._start) * 1000
+        self.max_duration = max(self.max_duration, duration)
+        if self.update_num:
+            duration = self.smoothing * self.duration + (1. - self.smoothing) * duration
+        self.duration = duration
+        self.update_num += 1
+
+    def text(self) -> str:
+        skipped = 1. - self.update_num / self.poll_num if self.poll_num else 0.
+        return f'GUI {self.duration:.1f} ms (max {self.max_duration:.1f} ms), {skipped:.0%} polls skipped'
+
+
+class FrameTimeOverlay:
+    """FrameTimeMeter shown as text in the top left corner of a pyqtgraph view_box, hidden until set_visible"""
+
+    def __init__(self, view_box, smoothing: float = 0.9):
+        self.meter = FrameTimeMeter(smoothing)
+        self.label = pg.TextItem(color='y', anchor=(0, 0))
+        self.label.setParentItem(view_box)
+        self.label.hide()
+
+    def set_visible(self, visible: bool):
+        self.label.setVisible(visible)
+
+    def start(self):
+        self.meter.start()
+
+    def stop(self):
+        """Mark the end of an update which uploaded a new image"""
+        self.meter.stop()
+        if self.label.isVisible():
+            self.label.setText(self.meter.text())
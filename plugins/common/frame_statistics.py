@@ -0,0 +1,56 @@
+from typing import Tuple
+
+import numpy as np
+
+# Statistics at the start of FrameReducer.values, followed by the block sums of the grid in row-major order
+statistic_names = ('sum', 'mean', 'max', 'saturated')
+
+
+class FrameReducer:
+    """Sum, mean, maximum, number of saturated pixels and block sums on a grid of uint8 frames
+
+    Frames are reduced in horizontal bands of one grid row each, so that the statistics of a band are computed
+    while it is still in cache (a few passes over each band, but a single pass over the frame from memory).
+    Column sums of a band are accumulated in uint32 and reduced to the block sums of the band, the total sum is
+    the sum of all blocks. Grid edges are spread evenly, so blocks may differ by one pixel in size if the frame
+    is not divisible by the grid.
+
+    Frames of shape (height, width, channels) are summed over all channels, a pixel counts as saturated if any
+    of its channels is.
+    """
+
+    def __init__(self, frame_shape: Tuple[int, int], grid_shape: Tuple[int, int] = (4, 4),
+                 saturation_level: int = 255):
+        self.frame_shape = tuple(frame_shape)
+        self.grid_shape = tuple(grid_shape)
+        self.saturation_level = saturation_level
+        self.row_edges = np.linspace(0, frame_shape[0], grid_shape[0] + 1).astype(int)
+        self.column_starts = np.linspace(0, frame_shape[1], grid_shape[1] + 1).astype(int)[:-1]
+
+        self.values = np.zeros(len(statistic_names) + grid_shape[0] * grid_shape[1], dtype=np.float64)
+        # View on the block sums in values
+        self.block_sums = self.values[len(statistic_names):].reshape(grid_shape)
+        self._column_sums = np.zeros(frame_shape[1], dtype=np.uint32)
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """Reduce (height, width) or (height, width, channels) frame and return values (updated in place)"""
+        if frame.ndim not in (2, 3) or frame.shape[:2] != self.frame_shape:
+            raise ValueError(f'Expected frame of shape {self.frame_shape} with optional channel axis, '
+                             f'got {frame.shape}')
+        axes = (0, 2) if frame.ndim == 3 else 0
+
+        maximum = 0
+        saturated = 0
+        for i, (start, stop) in enumerate(zip(self.row_edges[:-1], self.row_edges[1:])):
+            band = frame[start:stop]
+            np.sum(band, axis=axes, dtype=np.uint32, out=self._column_sums)
+            self.block_sums[i] = np.add.reduceat(self._column_sums, self.column_starts)
+            maximum = max(maximum, int(band.max()))
+            saturated_values = band >= self.saturation_level
+            if frame.ndim == 3:
+                saturated_values = saturated_values.any(axis=2)
+            saturated += np.count_nonzero(saturated_values)
+
+        total = self.block_sums.sum()
+        self.values[:len(statistic_names)] = total, total / frame.size, maximum, saturated
+        return self.values
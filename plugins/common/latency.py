@@ -0,0 +1,87 @@
+from typing import Tuple
+
+import numpy as np
+
+# Feedback taps of maximum length linear feedback shift registers by register length
+mls_taps = {5: (5, 3), 6: (6, 5), 7: (7, 6), 8: (8, 6, 5, 4), 9: (9, 5), 10: (10, 7)}
+
+
+def mls(bits: int = 7) -> np.ndarray:
+    """Maximum length sequence of 2 ** bits - 1 zeros and ones"""
+    taps = mls_taps[bits]
+    state = [1] * bits
+    sequence = np.zeros(2 ** bits - 1, dtype=np.uint8)
+    for i in range(sequence.shape[0]):
+        sequence[i] = state[-1]
+        feedback = 0
+        for tap in taps:
+            feedback ^= state[tap - 1]
+        state = [feedback] + state[:-1]
+    return sequence
+
+
+class LuminanceCode:
+    """Binary luminance code which repeats a maximum length sequence, each element shown for element_duration [s]
+
+    The code is a function of time only, so that display and camera processes agree on it without communication.
+    """
+
+    def __init__(self, element_duration: float = 1 / 15, bits: int = 7, low: float = 0.2, high: float = 0.8):
+        self.element_duration = element_duration
+        self.sequence = mls(bits)
+        self.low = low
+        self.high = high
+
+    @property
+    def period(self) -> float:
+        return self.element_duration * self.sequence.shape[0]
+
+    def elements(self, indices: np.ndarray) -> np.ndarray:
+        return self.sequence[np.asarray(indices, dtype=np.int64) % self.sequence.shape[0]]
+
+    def values(self, times: np.ndarray) -> np.ndarray:
+        """Code elements (0 or 1) shown at times [s]"""
+        return self.elements(np.floor(np.asarray(times) / self.element_duration))
+
+    def luminance(self, t: float) -> float:
+        return self.high if self.values(t) else self.low
+
+
+def estimate_latency(times: np.ndarray, signal: np.ndarray, code: LuminanceCode, max_latency: float = 0.25,
+                     resolution: float = 0.001) -> Tuple[float, float]:
+    """Return latency [s] between code and signal sampled at times [s] and the normalized correlation at that latency
+
+    The latency is the lag from 0 to max_latency (in steps of resolution) which maximizes the correlation
+    of signal with the code shown at times - lag.
+    """
+    lags = np.arange(0., max_latency + resolution / 2, resolution)
+    signal = signal - signal.mean()
+    expected = code.values(times[None, :] - lags[:, None]).astype(np.float64)
+    expected -= expected.mean(axis=1, keepdims=True)
+
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(signal)
+    correlation = np.divide(expected @ signal, norms, out=np.zeros(lags.shape[0]), where=norms > 0)
+    k = int(np.argmax(correlation))
+    return float(lags[k]), float(correlation[k])
+
+
+def edge_latencies(times: np.ndarray, signal: np.ndarray, code: LuminanceCode, latency: float,
+                   tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Return times [s] of all transitions of signal and their latencies [s] to the matching transitions of code
+
+    Transitions are crossings of the level halfway between signal minimum and maximum, interpolated between samples.
+    Each is matched to the code transition closest to its time - latency and dropped if the latency of the pair
+    differs from latency by more than tolerance.
+    """
+    level = (signal.min() + signal.max()) / 2
+    above = signal > level
+    idx = np.flatnonzero(above[1:] != above[:-1])
+    t0, t1 = times[idx], times[idx + 1]
+    v0, v1 = signal[idx].astype(np.float64), signal[idx + 1].astype(np.float64)
+    crossings = t0 + (level - v0) / (v1 - v0) * (t1 - t0)
+
+    # Closest element boundary of the code at which the code changes
+    k = np.round((crossings - latency) / code.element_duration)
+    latencies = crossings - k * code.element_duration
+    valid = (code.elements(k) != code.elements(k - 1)) & (np.abs(latencies - latency) <= tolerance)
+    return crossings[valid], latencies[valid]
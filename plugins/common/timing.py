@@ -0,0 +1,61 @@
+import time
+from typing import Sequence, Tuple
+
+import numpy as np
+
+
+class StageTimer:
+    """Per-frame wall time of processing stages with rolling percentiles over the last window frames
+
+    Durations are given in ms. start() begins a new frame, lap(index) adds the time since the last mark
+    to a stage and record() copies durations which were measured elsewhere (e.g. by a detector).
+    finish() ends the frame with the last stage.
+    """
+
+    def __init__(self, stage_names: Sequence[str], window: int = 1150):
+        self.stage_names = tuple(stage_names)
+        self.durations = np.zeros(len(self.stage_names), dtype=np.float32)
+        self._history = np.zeros((window, len(self.stage_names)), dtype=np.float32)
+        self._frame_num = 0
+        self._mark = 0.
+
+    def start(self):
+        self.durations[:] = 0
+        self._mark = time.perf_counter()
+
+    def lap(self, index: int):
+        now = time.perf_counter()
+        self.durations[index] += (now - self._mark) * 1000
+        self._mark = now
+
+    def record(self, durations: np.ndarray, offset: int = 0):
+        self.durations[offset:offset + len(durations)] = durations
+        self._mark = time.perf_counter()
+
+    def commit(self) -> bool:
+        """Add durations of current frame to history, returns True whenever a full window has passed"""
+        self._history[self._frame_num % self._history.shape[0]] = self.durations
+        self._frame_num += 1
+        return self._frame_num % self._history.shape[0] == 0
+
+    def finish(self, attributes: Sequence, log):
+        """Lap the last stage, write all durations to attributes (one per stage) and commit the frame
+
+        p50/p99 of all stages are logged to log whenever a full window has passed.
+        """
+        self.lap(len(self.stage_names) - 1)
+        for attribute, duration in zip(attributes, self.durations):
+            attribute.write(duration)
+        if self.commit():
+            log.info(f'Stage timing p50/p99 [ms]: {self.summary()}')
+
+    def percentiles(self) -> Tuple[np.ndarray, np.ndarray]:
+        """p50 and p99 of all stages over the window"""
+        history = self._history[:min(self._frame_num, self._history.shape[0])]
+        if history.shape[0] == 0:
+            return np.zeros(len(self.stage_names)), np.zeros(len(self.stage_names))
+        return np.percentile(history, 50, axis=0), np.percentile(history, 99, axis=0)
+
+    def summary(self) -> str:
+        p50, p99 = self.percentiles()
+        return ', '.join(f'{name} {a:.2f}/{b:.2f}' for name, a, b in zip(self.stage_names, p50, p99))
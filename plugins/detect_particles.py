@@ -15,20 +15,39 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
-import cv2
 import numpy as np
-from PySide6 import QtWidgets
+from PySide6 import QtCore, QtWidgets
 import pyqtgraph as pg
 
-from vxpy.api.attribute import ArrayAttribute, ArrayType, read_attribute
+from vxpy.api.attribute import ArrayAttribute, ArrayType, get_attribute
 from vxpy.api.camera import get_config_for_camera, Format
 from vxpy.api.dependency import require_camera_device
 from vxpy.api.routine import CameraRoutine
-from vxpy.api.ui import AddonWidget
+from vxpy.api.ui import AddonWidget, register_with_plotter
+import vxpy.core.logger as vxlogger
+from vxpy.utils import widgets
+
+from plugins.common import contours, display, timing
+
+log = vxlogger.getLogger(__name__)
 
 
 class ParticleDetection(CameraRoutine):
 
+    # Published geometry: particle and vertex count limits
+    max_contour_number = 50
+    max_vertex_number = 64
+    # Threshold: 'fixed', 'otsu' or 'percentile' (see plugins.common.contours.AdaptiveThreshold), min_area [px]
+    threshold_mode = 'fixed'
+    thresh_val = 70
+    threshold_percentile = 5.
+    threshold_interval = 100
+    threshold_stride = 4
+    min_area = 300
+    # Per-stage wall time [ms] in particle_detection_timing_<stage> (see plugins.common.timing.StageTimer)
+    timing_enabled = False
+    timing_window = 1000
+
     def __init__(self, *args, **kwargs):
         CameraRoutine.__init__(self, *args, **kwargs)
 
@@ -42,12 +61,92 @@ class ParticleDetection(CameraRoutine):
         self.res_x = fmt.width
         self.res_y = fmt.height
 
-        # Create an array attribute to store output image in
-        self.frame_with_keypoints = ArrayAttribute('frame_with_keypoints', (self.res_y, self.res_x, 3), ArrayType.uint8)
+        # Create array attributes for the particle geometry (the frame itself is published by the camera)
+        n, v = self.max_contour_number, self.max_vertex_number
+        self.particle_contour_count = ArrayAttribute('particle_contour_count', (1,), ArrayType.uint64)
+        self.particle_contour_vertices = ArrayAttribute('particle_contour_vertices', (n, v, 2), ArrayType.int16)
+        self.particle_contour_vertex_counts = ArrayAttribute('particle_contour_vertex_counts', (n,), ArrayType.uint16)
+        self.particle_contour_areas = ArrayAttribute('particle_contour_areas', (n,), ArrayType.float32)
+        self.particle_contour_centroids = ArrayAttribute('particle_contour_centroids', (n, 2), ArrayType.float32)
+
+        # Output buffers, reused in place
+        self._vertices = np.zeros((n, v, 2), dtype=np.int16)
+        self._vertex_counts = np.zeros(n, dtype=np.uint16)
+        self._areas = np.zeros(n, dtype=np.float32)
+        self._centroids = -np.ones((n, 2), dtype=np.float32)
+
+        # Threshold and contour filter for dark particles
+        self.detector = contours.ContourDetector(thresh_val=self.thresh_val, min_area=self.min_area)
+        self.threshold_estimator = None
+        self._frame_index = 0
+        self.set_threshold_mode(self.threshold_mode)
+
+        # Applied processing parameters of every frame
+        self.particle_detection_threshold = ArrayAttribute('particle_detection_threshold', (1,), ArrayType.uint8)
+        self.particle_detection_min_area = ArrayAttribute('particle_detection_min_area', (1,), ArrayType.float32)
+        self.particle_detection_threshold_interval = ArrayAttribute('particle_detection_threshold_interval', (1,),
+                                                                    ArrayType.uint32)
+
+        # Stage timing (contour detection stages, geometry packing and attribute write)
+        self.timer = timing.StageTimer((*self.detector.stage_names, 'pack', 'write'), self.timing_window)
+        self.timing_attributes = [ArrayAttribute(f'particle_detection_timing_{name}', (1,), ArrayType.float32)
+                                  for name in self.timer.stage_names]
 
     def initialize(self):
-        # Mark output array attribute as something to be written to file
-        self.frame_with_keypoints.add_to_file()
+        # Mark output array attributes as something to be written to file
+        self.particle_contour_count.add_to_file()
+        self.particle_contour_vertices.add_to_file()
+        self.particle_contour_vertex_counts.add_to_file()
+        self.particle_contour_areas.add_to_file()
+        self.particle_contour_centroids.add_to_file()
+        self.particle_detection_threshold.add_to_file()
+        self.particle_detection_min_area.add_to_file()
+        self.particle_detection_threshold_interval.add_to_file()
+        register_with_plotter(self.particle_detection_threshold.name, axis='particle_detection_threshold')
+
+        self.exposed.append(ParticleDetection.set_timing_enabled)
+        self.exposed.append(ParticleDetection.set_threshold_mode)
+        self.exposed.append(ParticleDetection.set_thresh_val)
+        self.exposed.append(ParticleDetection.set_threshold_percentile)
+        self.exposed.append(ParticleDetection.set_threshold_interval)
+        self.exposed.append(ParticleDetection.set_min_area)
+        for attribute in self.timing_attributes:
+            register_with_plotter(attribute.name, axis='particle_detection_timing')
+            attribute.add_to_file()
+
+    def set_timing_enabled(self, value):
+        self.timing_enabled = bool(value)
+
+    def set_threshold_mode(self, value):
+        if value != 'fixed' and value not in contours.AdaptiveThreshold.methods:
+            log.error(f'Unknown threshold mode {value}')
+            return
+        self.threshold_mode = value
+        if value == 'fixed':
+            self.threshold_estimator = None
+            self.detector.thresh_val = self.thresh_val
+        else:
+            self.threshold_estimator = contours.AdaptiveThreshold(value, self.threshold_percentile,
+                                                                  self.threshold_stride)
+            # Estimate on the next frame
+            self._frame_index = 0
+
+    def set_thresh_val(self, value):
+        self.thresh_val = int(value)
+        if self.threshold_estimator is None:
+            self.detector.thresh_val = self.thresh_val
+
+    def set_threshold_percentile(self, value):
+        self.threshold_percentile = float(value)
+        if self.threshold_estimator is not None:
+            self.threshold_estimator.percentile = self.threshold_percentile
+
+    def set_threshold_interval(self, value):
+        self.threshold_interval = max(int(value), 1)
+
+    def set_min_area(self, value):
+        self.min_area = float(value)
+        self.detector.min_area = self.min_area
 
     def main(self, *args, **frames):
         # Read frame
@@ -57,24 +156,41 @@ class ParticleDetection(CameraRoutine):
         if frame is None:
             return
 
-        # Apply inv. threshold (filter for dark particles)
-        ret, thresh = cv2.threshold(frame, 70, 255, cv2.THRESH_BINARY_INV)
+        # Update threshold estimate every threshold_interval frames, in between it is only applied
+        if self.threshold_estimator is not None and self._frame_index % self.threshold_interval == 0:
+            self.detector.thresh_val = self.threshold_estimator.update(frame)
+        self._frame_index += 1
 
-        # Find contours
-        contours, hierarchy = cv2.findContours(thresh, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        # Find contours of dark particles
+        particle_contours = self.detector.apply(frame)
+        if self.timing_enabled:
+            self.timer.start()
+            self.timer.record(self.detector.stage_durations)
 
-        # Filter contours for minimum area size and draw on RGB new_frame
-        new_frame = np.repeat(frame[:,:,np.newaxis], 3, axis=-1)
-        for cnt in contours:
-            if cv2.contourArea(cnt) > 300:
-                cv2.drawContours(new_frame, [cnt], -1, (255, 0, 0), 2)
+        # Simplify contours into fixed size geometry arrays
+        count = contours.pack(particle_contours, self._vertices, self._vertex_counts, self._areas, self._centroids)
+        if self.timing_enabled:
+            self.timer.lap(len(self.detector.stage_names))
 
-        # Write frame with drawn contours to attribute
-        self.frame_with_keypoints.write(new_frame)
+        # Write geometry to attributes
+        self.particle_contour_count.write(count)
+        self.particle_contour_vertices.write(self._vertices)
+        self.particle_contour_vertex_counts.write(self._vertex_counts)
+        self.particle_contour_areas.write(self._areas)
+        self.particle_contour_centroids.write(self._centroids)
+        self.particle_detection_threshold.write(self.detector.thresh_val)
+        self.particle_detection_min_area.write(self.detector.min_area)
+        self.particle_detection_threshold_interval.write(self.threshold_interval)
+
+        if self.timing_enabled:
+            self.timer.finish(self.timing_attributes, log)
 
 
 class ParticleDetectionWidget(AddonWidget):
 
+    # Camera frame attribute the contours were detected on
+    frame_attribute = 'multiple_fish_frame'
+
     def __init__(self, *args, **kwargs):
         AddonWidget.__init__(self, *args, **kwargs)
         self.setLayout(QtWidgets.QHBoxLayout())
@@ -93,14 +209,138 @@ class ParticleDetectionWidget(AddonWidget):
         self.item = pg.ImageItem()
         self.plot.addItem(self.item)
 
+        # Add contour outlines (all polygons in one item, separated by NaN) and centroids
+        self.contour_item = pg.PlotDataItem(pen=pg.mkPen(color=(255, 0, 0), width=2), connect='finite')
+        self.plot.addItem(self.contour_item)
+        self.centroid_item = pg.ScatterPlotItem(size=6, pen=None, brush=pg.mkBrush(255, 0, 0))
+        self.plot.addItem(self.centroid_item)
+
+        # GUI frame time (debug overlay)
+        self.frame_time = display.FrameTimeOverlay(self.plot.vb)
+
+        # Last displayed indices of the frame and contour attributes
+        self._frame_attribute = None
+        self._last_frame_index = None
+        self._contour_attributes = None
+        self._last_contour_index = None
+
+        # Add parameter console
+        self.console = QtWidgets.QWidget(self)
+        self.console.setLayout(QtWidgets.QVBoxLayout())
+        self.console.setMaximumWidth(300)
+        self.layout().addWidget(self.console)
+        # Threshold mode
+        self.threshold_mode = widgets.ComboBox(self)
+        self.threshold_mode.connect_callback(self.set_threshold_mode)
+        self.threshold_mode.add_items(['fixed', *contours.AdaptiveThreshold.methods])
+        self.console.layout().addWidget(self.threshold_mode)
+        # Fixed threshold
+        self.thresh_val = widgets.IntSliderWidget(self.console, label='Threshold [au]',
+                                                  default=ParticleDetection.thresh_val, limits=(1, 254))
+        self.thresh_val.connect_callback(self.set_thresh_val)
+        self.console.layout().addWidget(self.thresh_val)
+        # Percentile of adaptive threshold
+        self.threshold_percentile = widgets.IntSliderWidget(self.console, label='Threshold percentile [%]',
+                                                            default=int(ParticleDetection.threshold_percentile),
+                                                            limits=(1, 99))
+        self.threshold_percentile.connect_callback(self.set_threshold_percentile)
+        self.console.layout().addWidget(self.threshold_percentile)
+        # Update interval of adaptive threshold
+        self.threshold_interval = widgets.IntSliderWidget(self.console, label='Threshold interval [frames]',
+                                                          default=ParticleDetection.threshold_interval,
+                                                          limits=(1, 1000))
+        self.threshold_interval.connect_callback(self.set_threshold_interval)
+        self.console.layout().addWidget(self.threshold_interval)
+        # Min area
+        self.min_area = widgets.IntSliderWidget(self.console, label='Min. area [px]',
+                                                default=ParticleDetection.min_area, limits=(1, 2000))
+        self.min_area.connect_callback(self.set_min_area)
+        self.console.layout().addWidget(self.min_area)
+        # GUI frame time
+        self.frame_time_enabled = QtWidgets.QCheckBox('GUI frame time')
+        self.frame_time_enabled.stateChanged.connect(self.set_frame_time_visible)
+        self.console.layout().addWidget(self.frame_time_enabled)
+        self.console.layout().addItem(QtWidgets.QSpacerItem(1, 1, QtWidgets.QSizePolicy.Policy.Minimum,
+                                                            QtWidgets.QSizePolicy.Policy.MinimumExpanding))
+
+    def set_threshold_mode(self, mode):
+        self.call_routine(ParticleDetection.set_threshold_mode, mode)
+
+    def set_thresh_val(self, value):
+        self.call_routine(ParticleDetection.set_thresh_val, value)
+
+    def set_threshold_percentile(self, value):
+        self.call_routine(ParticleDetection.set_threshold_percentile, value)
+
+    def set_threshold_interval(self, value):
+        self.call_routine(ParticleDetection.set_threshold_interval, value)
+
+    def set_min_area(self, value):
+        self.call_routine(ParticleDetection.set_min_area, value)
+
+    def set_frame_time_visible(self):
+        self.frame_time.set_visible(self.frame_time_enabled.isChecked())
+
     def update_frame(self):
+        self.frame_time.start()
+        if self._frame_attribute is None:
+            self._frame_attribute = get_attribute(self.frame_attribute)
+            if self._frame_attribute is None:
+                return
+
+        # Skip polls without a new frame
+        index = self._frame_attribute.index
+        if index == self._last_frame_index:
+            return
+
         # Read the attribute
-        i, t, v = read_attribute('frame_with_keypoints')
+        i, t, v = self._frame_attribute.read()
 
         # Make sure there's is a frame
         if t[0] is None:
             return
+        self._last_frame_index = index
         frame = v[0]
 
-        # Update image item
-        self.item.setImage(frame)
\ No newline at end of file
+        # Update image item, downsampled to its size on screen but in full resolution pixel coordinates
+        self.item.setImage(display.downsample(frame, display.screen_size(self.plot.vb, frame.shape)))
+        self.item.setRect(QtCore.QRectF(0, 0, frame.shape[0], frame.shape[1]))
+
+        self._update_overlays()
+        self.frame_time.stop()
+
+    def _update_overlays(self):
+        if self._contour_attributes is None:
+            self._contour_attributes = [get_attribute(name) for name in ('particle_contour_count',
+                                                                        'particle_contour_vertices',
+                                                                        'particle_contour_vertex_counts',
+                                                                        'particle_contour_centroids')]
+            if any(attribute is None for attribute in self._contour_attributes):
+                self._contour_attributes = None
+                return
+
+        # All geometry attributes are written once per frame, centroids last:
+        # its last entry is complete in all of them. Skip if there is no new geometry
+        index = self._contour_attributes[-1].index - 1
+        if index < 0 or index == self._last_contour_index:
+            return
+
+        # Read all geometry of the same frame
+        entries = [attribute[index] for attribute in self._contour_attributes]
+        if any(idx[0] != index for idx, _, _ in entries):
+            return
+        self._last_contour_index = index
+        count, vertices, vertex_counts, centroids = (value[0] for _, _, value in entries)
+        count = int(count[0])
+        vertices, vertex_counts, centroids = vertices[:count], vertex_counts[:count], centroids[:count]
+
+        # Closed polygons, separated by NaN
+        points = []
+        for polygon, vertex_count in zip(vertices, vertex_counts):
+            polygon = polygon[:vertex_count].astype(np.float64)
+            points.extend([polygon, polygon[:1], np.full((1, 2), np.nan)])
+        points = np.concatenate(points) if points else np.zeros((0, 2))
+
+        # Image item shows axis 0 of the frame (rows, y) along x
+        self.contour_item.setData(points[:, 1], points[:, 0])
+        self.centroid_item.setData(centroids[:, 1], centroids[:, 0])
\ No newline at end of file
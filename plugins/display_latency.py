@@ -0,0 +1,149 @@
+import numpy as np
+
+from vxpy import config
+from vxpy.api.attribute import ArrayAttribute, ArrayType, get_attribute
+from vxpy.api.dependency import require_camera_device
+from vxpy.api.routine import CameraRoutine
+from vxpy.api import ui
+import vxpy.core.ipc as vxipc
+import vxpy.core.logger as vxlogger
+
+from plugins.common import latency
+
+log = vxlogger.getLogger(__name__)
+
+
+class DisplayLatency(CameraRoutine):
+    """End-to-end latency from rendering to the control camera, measured with visuals.latency_code.LatencyCode
+
+    Every estimate_interval frames the last window pixel sums are cross-correlated with the luminance code,
+    estimates below min_correlation are discarded. Single transition latencies and their jitter around the estimate
+    are accumulated in histograms. With simulated_delay set, the pixel sum is replaced by the delayed code.
+    Needs plugins.calculate_pixel_sum.CalculateControlCamPixelSum to run before it on the same camera.
+    """
+
+    camera_id = 'faraday_control_cam'
+    # Estimate: interval and window [frames], max_latency [ms]
+    estimate_interval = 80
+    window = 800
+    max_latency = 250.
+    min_correlation = 0.7
+    # Histograms: bin size and jitter range [ms]
+    latency_bin_size = 1.
+    max_jitter = 20.
+    # Simulation (e.g. virtual camera): delay and gaussian jitter [ms]
+    simulated_delay = None
+    simulated_jitter = 2.
+
+    def __init__(self, *args, **kwargs):
+        CameraRoutine.__init__(self, *args, **kwargs)
+
+        # (optional) Make sure right camera is configured (easier debugging)
+        require_camera_device(self.camera_id)
+
+    def setup(self):
+        camera_config = config.CONF_CAMERA_DEVICES.get(self.camera_id)
+        self.simulated_delay = camera_config.get('simulated_display_delay', self.simulated_delay)
+
+        self.code = latency.LuminanceCode()
+        self.rng = np.random.default_rng()
+
+        # Ring buffers of pixel sum samples
+        self._times = np.zeros(self.window, dtype=np.float64)
+        self._values = np.zeros(self.window, dtype=np.float64)
+        self._sample_num = 0
+        self._pixel_sum_attribute = None
+        self._last_index = None
+        # Transitions up to this time [s] are in the histograms
+        self._last_edge_time = -np.inf
+
+        # Output attributes, written on every estimate
+        self.latency_bins = np.arange(0., self.max_latency + self.latency_bin_size, self.latency_bin_size)
+        self.jitter_bins = np.arange(-self.max_jitter, self.max_jitter + self.latency_bin_size, self.latency_bin_size)
+        self.display_latency = ArrayAttribute('display_latency', (1,), ArrayType.float64)
+        self.display_latency_correlation = ArrayAttribute('display_latency_correlation', (1,), ArrayType.float64)
+        self.display_latency_jitter = ArrayAttribute('display_latency_jitter', (1,), ArrayType.float64)
+        self.display_latency_histogram = ArrayAttribute('display_latency_histogram',
+                                                        (self.latency_bins.shape[0] - 1,), ArrayType.uint32)
+        self.display_latency_jitter_histogram = ArrayAttribute('display_latency_jitter_histogram',
+                                                               (self.jitter_bins.shape[0] - 1,), ArrayType.uint32)
+        self.latency_histogram = np.zeros(self.latency_bins.shape[0] - 1, dtype=np.uint32)
+        self.jitter_histogram = np.zeros(self.jitter_bins.shape[0] - 1, dtype=np.uint32)
+
+    def initialize(self):
+        self.display_latency.add_to_file()
+        self.display_latency_correlation.add_to_file()
+        self.display_latency_jitter.add_to_file()
+        self.display_latency_histogram.add_to_file()
+        self.display_latency_jitter_histogram.add_to_file()
+        ui.register_with_plotter(self.display_latency.name, axis='display_latency')
+        ui.register_with_plotter(self.display_latency_jitter.name, axis='display_latency')
+
+        self.exposed.append(DisplayLatency.set_simulated_delay)
+        self.exposed.append(DisplayLatency.reset_histograms)
+
+    def set_simulated_delay(self, value):
+        self.simulated_delay = value
+
+    def reset_histograms(self):
+        self.latency_histogram[:] = 0
+        self.jitter_histogram[:] = 0
+
+    def _next_sample(self, frame):
+        """Return time [s] and value of a new pixel sum sample, or None if there is none"""
+        if self.simulated_delay is not None:
+            # Code shown simulated_delay earlier on a display with the luminance range of an 8 bit camera
+            t = vxipc.get_time()
+            shown = t - (self.simulated_delay + self.rng.normal(0., self.simulated_jitter)) / 1000
+            return t, self.code.luminance(shown) * 255 * frame.size
+
+        if self._pixel_sum_attribute is None:
+            self._pixel_sum_attribute = get_attribute('control_cam_pixel_sum')
+            if self._pixel_sum_attribute is None:
+                return None
+        index = self._pixel_sum_attribute.index
+        if index == self._last_index:
+            return None
+        self._last_index = index
+
+        _, times, values = self._pixel_sum_attribute.read()
+        if times[0] is None:
+            return None
+        return times[0], float(values[0][0])
+
+    def main(self, *args, **frames):
+        frame = frames.get(self.camera_id)
+        if frame is None:
+            return
+
+        sample = self._next_sample(frame)
+        if sample is None:
+            return
+        k = self._sample_num % self.window
+        self._times[k], self._values[k] = sample
+        self._sample_num += 1
+
+        if self._sample_num < self.window or self._sample_num % self.estimate_interval != 0:
+            return
+
+        # Samples of the window in order
+        order = np.roll(np.arange(self.window), -(self._sample_num % self.window))
+        times, values = self._times[order], self._values[order]
+        estimate, correlation = latency.estimate_latency(times, values, self.code, self.max_latency / 1000)
+        self.display_latency_correlation.write(correlation)
+        if correlation < self.min_correlation:
+            return
+
+        # Latencies [ms] of single transitions, only those which were not in a previous window are histogrammed
+        edge_times, latencies = latency.edge_latencies(times, values, self.code, estimate, self.max_jitter / 1000)
+        latencies *= 1000
+        new_latencies = latencies[edge_times > self._last_edge_time]
+        if edge_times.shape[0] > 0:
+            self._last_edge_time = edge_times[-1]
+        self.latency_histogram += np.histogram(new_latencies, self.latency_bins)[0].astype(np.uint32)
+        self.jitter_histogram += np.histogram(new_latencies - estimate * 1000, self.jitter_bins)[0].astype(np.uint32)
+
+        self.display_latency.write(estimate * 1000)
+        self.display_latency_jitter.write(latencies.std() if latencies.shape[0] > 1 else 0.)
+        self.display_latency_histogram.write(self.latency_histogram)
+        self.display_latency_jitter_histogram.write(self.jitter_histogram)
@@ -0,0 +1,95 @@
+from typing import Sequence, Tuple
+
+import cv2
+import numpy as np
+
+
+class Arena:
+    """Region of a frame to which tracking is restricted
+
+    Frames are expected in (height, width) layout, positions (pos, size and polygon points)
+    are given in (x, y) image coordinates, like the calibration rectangle of the tracker.
+    """
+
+    def __init__(self, frame_shape: Tuple[int, int]):
+        self.frame_shape = tuple(frame_shape)
+        self.slices = (slice(0, self.frame_shape[0]), slice(0, self.frame_shape[1]))
+        self.mask = None
+        self._scaled_mask = None
+        self.set_full_frame()
+
+    @property
+    def is_full_frame(self) -> bool:
+        return self.shape == self.frame_shape and self.mask is None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.slices[0].stop - self.slices[0].start, self.slices[1].stop - self.slices[1].start
+
+    @property
+    def offset(self) -> np.ndarray:
+        """Offset of the arena in (x, y) image coordinates"""
+        return np.array([self.slices[1].start, self.slices[0].start])
+
+    def _set_bounds(self, pos: Sequence[float], size: Sequence[float]):
+        frame_size = np.array(self.frame_shape[::-1])
+        start = np.clip(np.floor(pos).astype(int), 0, frame_size - 1)
+        stop = np.clip(np.ceil(np.asarray(pos) + np.asarray(size)).astype(int), start + 1, frame_size)
+        self.slices = (slice(start[1], stop[1]), slice(start[0], stop[0]))
+
+    def set_full_frame(self):
+        self.slices = (slice(0, self.frame_shape[0]), slice(0, self.frame_shape[1]))
+        self.mask = None
+        self._scaled_mask = None
+
+    def set_rectangle(self, pos: Sequence[float], size: Sequence[float]):
+        self._set_bounds(pos, size)
+        self.mask = None
+        self._scaled_mask = None
+
+    def set_polygon(self, points: Sequence[Sequence[float]]):
+        points = np.asarray(points, dtype=np.float64)
+        if points.shape[0] < 3:
+            self.set_full_frame()
+            return
+
+        pos = points.min(axis=0)
+        self._set_bounds(pos, points.max(axis=0) - pos)
+
+        # Rasterize polygon into binary mask for bounding rectangle
+        self.mask = np.zeros(self.shape, dtype=np.uint8)
+        cv2.fillPoly(self.mask, [np.round(points - self.offset).astype(np.int32)], 255)
+        self._scaled_mask = None
+
+    def crop(self, frame: np.ndarray) -> np.ndarray:
+        """Return view on arena region of frame"""
+        return frame[self.slices]
+
+    def scaled_mask(self, shape: Tuple[int, int]) -> np.ndarray:
+        """Return polygon mask (or None) resized to shape, e.g. of a downsampled version of the arena region"""
+        if self.mask is None or self.mask.shape == tuple(shape):
+            return self.mask
+
+        if self._scaled_mask is None or self._scaled_mask.shape != tuple(shape):
+            self._scaled_mask = cv2.resize(self.mask, shape[::-1], interpolation=cv2.INTER_NEAREST)
+        return self._scaled_mask
+
+    def apply_mask(self, frame: np.ndarray):
+        """Set all pixels outside of the arena polygon to zero (in place)
+
+        Frame may be a downsampled version of the arena region.
+        """
+        mask = self.scaled_mask(frame.shape)
+        if mask is not None:
+            cv2.bitwise_and(frame, mask, dst=frame)
+
+    def to_full_frame(self, centroids: np.ndarray) -> np.ndarray:
+        """Map (x, y) points from arena to full-frame coordinates"""
+        return centroids + self.offset
+
+    def paste(self, arena_frame: np.ndarray, full_frame: np.ndarray) -> np.ndarray:
+        """Write arena sized frame into its region of a full sized frame"""
+        if self.is_full_frame:
+            return arena_frame
+        full_frame[self.slices] = arena_frame
+        return full_frame
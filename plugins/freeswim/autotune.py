@@ -0,0 +1,117 @@
+import threading
+from typing import NamedTuple, Optional, Sequence
+
+import cv2
+import numpy as np
+
+from plugins.freeswim import particles
+
+
+class TuneResult(NamedTuple):
+    binary_thresh_val: int
+    filter_size: int
+    min_area: int
+    # Mean absolute deviation from target count, standard deviation of counts and combined score (lower is better)
+    count_error: float
+    count_std: float
+    score: float
+
+
+def search(frames: np.ndarray, target_count: int, mask: np.ndarray = None,
+           thresholds: Sequence[int] = range(10, 230, 15), filter_sizes: Sequence[int] = (11, 21, 31, 41, 51),
+           min_areas: Sequence[int] = (5, 10, 20, 40, 80, 160, 240), foreground_thresh_val: int = 15,
+           stability_weight: float = 0.5) -> TuneResult:
+    """Find processing parameters for which the number of blobs in frames is closest to target_count
+
+    Foreground is taken as the difference to the median of frames, which approximates the tracker's background
+    model. Every parameter combination is scored by the mean absolute deviation of the per-frame blob count
+    from target_count plus stability_weight times the standard deviation of the counts.
+    """
+    background_image = np.median(frames, axis=0).astype(np.uint8)
+    diff = np.zeros_like(background_image)
+    foreground = np.zeros_like(background_image)
+    thresholds = np.asarray(thresholds)
+    min_areas = np.asarray(min_areas)
+
+    # counts[filter, threshold, min area, frame]
+    counts = np.zeros((len(filter_sizes), len(thresholds), len(min_areas), frames.shape[0]))
+    for k, frame in enumerate(frames):
+        cv2.absdiff(frame, background_image, dst=diff)
+        cv2.threshold(diff, foreground_thresh_val, 255, cv2.THRESH_BINARY, dst=foreground)
+        if mask is not None:
+            cv2.bitwise_and(foreground, mask, dst=foreground)
+
+        for i, filter_size in enumerate(filter_sizes):
+            filtered = cv2.GaussianBlur(foreground, (filter_size, filter_size), cv2.BORDER_DEFAULT)
+            for j, thresh_val in enumerate(thresholds):
+                _, binary = cv2.threshold(filtered, int(thresh_val), 255, cv2.THRESH_BINARY)
+                areas, _, _ = particles.detect_blobs(binary)
+                counts[i, j, :, k] = np.count_nonzero(areas[None, :] >= min_areas[:, None], axis=1)
+
+    count_error = np.abs(counts - target_count).mean(axis=-1)
+    count_std = counts.std(axis=-1)
+    score = count_error + stability_weight * count_std
+    i, j, l = np.unravel_index(np.argmin(score), score.shape)
+
+    return TuneResult(int(thresholds[j]), int(filter_sizes[i]), int(min_areas[l]),
+                      float(count_error[i, j, l]), float(count_std[i, j, l]), float(score[i, j, l]))
+
+
+class AutoTuner:
+    """Sample frames into a ring buffer and search processing parameters in a worker thread
+
+    add_frame only copies every sample_interval-th frame while sampling and never waits for the search,
+    the result is picked up by polling result.
+    """
+
+    def __init__(self, frame_num: int = 32, sample_interval: int = 10):
+        self.frame_num = frame_num
+        self.sample_interval = sample_interval
+        self.target_count = 0
+        self.mask = None
+        self.result: Optional[TuneResult] = None
+        self._frames = None
+        self._sample_num = 0
+        self._call_num = 0
+        self._sampling = False
+        self._thread = None
+
+    @property
+    def busy(self) -> bool:
+        return self._sampling or (self._thread is not None and self._thread.is_alive())
+
+    def start(self, target_count: int, mask: np.ndarray = None):
+        """Begin sampling, the search starts once the ring buffer is full"""
+        if self.busy:
+            return
+        self.target_count = target_count
+        self.mask = mask
+        self.result = None
+        self._sample_num = 0
+        self._call_num = 0
+        self._sampling = True
+
+    def add_frame(self, frame: np.ndarray):
+        if not self._sampling:
+            return
+
+        self._call_num += 1
+        if self._call_num % self.sample_interval != 0:
+            return
+
+        if self._frames is None or self._frames.shape[1:] != frame.shape:
+            self._frames = np.zeros((self.frame_num, *frame.shape), dtype=np.uint8)
+            self._sample_num = 0
+        self._frames[self._sample_num % self.frame_num] = frame
+        self._sample_num += 1
+
+        if self._sample_num >= self.frame_num:
+            self._sampling = False
+            # Buffer is not written to until the next start, which waits for the search to finish
+            self._thread = threading.Thread(target=self._run, args=(self._frames,), name='freeswim_autotune',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self, frames: np.ndarray):
+        mask = self.mask if self.mask is not None and self.mask.shape == frames.shape[1:] else None
+        self.result = search(frames, self.target_count, mask)
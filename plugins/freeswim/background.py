@@ -0,0 +1,216 @@
+import os
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+
+class BackgroundModel:
+    """Base class of background models for foreground detection on grayscale uint8 frames
+
+    Subclasses return a uint8 foreground mask (0 or 255) for every frame passed to apply
+    and keep their state in buffers which are allocated once on the first frame.
+    """
+
+    name: str = None
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def background_image(self) -> Optional[np.ndarray]:
+        raise NotImplementedError
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """Return arrays from which the model can be restored with set_state (empty if nothing was learned yet)"""
+        raise NotImplementedError
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        raise NotImplementedError
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the model state in bytes"""
+        raise NotImplementedError
+
+
+class MOG2Background(BackgroundModel):
+    """Mixture of gaussians background subtraction"""
+
+    name = 'mog2'
+
+    def __init__(self, history: int = 400):
+        self.model = cv2.createBackgroundSubtractorMOG2(history, detectShadows=False)
+        self._pixel_num = 0
+        self._mask = None
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        self._pixel_num = frame.shape[0] * frame.shape[1]
+        if self._mask is None or self._mask.shape != frame.shape[:2]:
+            self._mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+        return self.model.apply(frame, fgmask=self._mask)
+
+    def background_image(self) -> Optional[np.ndarray]:
+        return self.model.getBackgroundImage()
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        if self._pixel_num == 0:
+            return {}
+        return {'background': self.model.getBackgroundImage()}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        # Mixture state can not be restored, initialize model from learned background image instead
+        self.model.apply(state['background'], learningRate=1.)
+        self._pixel_num = state['background'].shape[0] * state['background'].shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        # Weight, mean and variance (float32) per mixture and pixel (estimate, state is held by OpenCV)
+        return self._pixel_num * self.model.getNMixtures() * 3 * 4
+
+
+class RunningMeanBackground(BackgroundModel):
+    """Exponential running mean background with fixed difference threshold"""
+
+    name = 'running_mean'
+
+    def __init__(self, alpha: float = 0.01, thresh_val: int = 15):
+        self.alpha = alpha
+        self.thresh_val = thresh_val
+        self._mean = None
+        self._background = None
+        self._diff = None
+        self._mask = None
+
+    def _allocate(self, frame: np.ndarray):
+        self._mean = frame.astype(np.float32)
+        self._background = frame.copy()
+        self._diff = np.zeros_like(frame)
+        self._mask = np.zeros_like(frame)
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        if self._mean is None or self._mean.shape != frame.shape:
+            self._allocate(frame)
+
+        cv2.absdiff(frame, self._background, dst=self._diff)
+        cv2.threshold(self._diff, self.thresh_val, 255, cv2.THRESH_BINARY, dst=self._mask)
+
+        # Update running mean in place
+        cv2.accumulateWeighted(frame, self._mean, self.alpha)
+        cv2.convertScaleAbs(self._mean, dst=self._background)
+
+        return self._mask
+
+    def background_image(self) -> Optional[np.ndarray]:
+        return self._background
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        if self._mean is None:
+            return {}
+        return {'mean': self._mean}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        self._allocate(state['mean'].astype(np.uint8))
+        self._mean[:] = state['mean']
+        cv2.convertScaleAbs(self._mean, dst=self._background)
+
+    @property
+    def nbytes(self) -> int:
+        if self._mean is None:
+            return 0
+        return self._mean.nbytes + self._background.nbytes + self._diff.nbytes + self._mask.nbytes
+
+
+class PeriodicMedianBackground(BackgroundModel):
+    """Median over a ring buffer of frame snapshots, recalculated whenever a new snapshot is taken"""
+
+    name = 'periodic_median'
+
+    def __init__(self, snapshot_interval: int = 50, snapshot_num: int = 9, thresh_val: int = 15):
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_num = snapshot_num
+        self.thresh_val = thresh_val
+        self._snapshots = None
+        self._background = None
+        self._diff = None
+        self._mask = None
+        self._frame_counter = 0
+        self._snapshot_counter = 0
+
+    def _allocate(self, frame: np.ndarray):
+        self._snapshots = np.zeros((self.snapshot_num, *frame.shape), dtype=np.uint8)
+        self._background = frame.copy()
+        self._diff = np.zeros_like(frame)
+        self._mask = np.zeros_like(frame)
+        self._frame_counter = 0
+        self._snapshot_counter = 0
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        if self._snapshots is None or self._snapshots.shape[1:] != frame.shape:
+            self._allocate(frame)
+
+        if self._frame_counter % self.snapshot_interval == 0:
+            self._snapshots[self._snapshot_counter % self.snapshot_num] = frame
+            self._snapshot_counter += 1
+            self._background[:] = np.median(self._snapshots[:min(self._snapshot_counter, self.snapshot_num)], axis=0)
+        self._frame_counter += 1
+
+        cv2.absdiff(frame, self._background, dst=self._diff)
+        cv2.threshold(self._diff, self.thresh_val, 255, cv2.THRESH_BINARY, dst=self._mask)
+
+        return self._mask
+
+    def background_image(self) -> Optional[np.ndarray]:
+        return self._background
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        if self._snapshots is None:
+            return {}
+        return {'snapshots': self._snapshots, 'background': self._background,
+                'counters': np.array([self._frame_counter, self._snapshot_counter])}
+
+    def set_state(self, state: Dict[str, np.ndarray]):
+        snapshots = state['snapshots']
+        if snapshots.shape[0] != self.snapshot_num:
+            self.snapshot_num = snapshots.shape[0]
+        self._allocate(state['background'])
+        self._snapshots[:] = snapshots
+        self._frame_counter, self._snapshot_counter = (int(v) for v in state['counters'])
+
+    @property
+    def nbytes(self) -> int:
+        if self._snapshots is None:
+            return 0
+        return self._snapshots.nbytes + self._background.nbytes + self._diff.nbytes + self._mask.nbytes
+
+
+engines = {cls.name: cls for cls in [MOG2Background, RunningMeanBackground, PeriodicMedianBackground]}
+
+
+def create(name: str) -> BackgroundModel:
+    return engines[name]()
+
+
+def save_state(model: BackgroundModel, filepath: str) -> bool:
+    """Write model state to .npz file, returns False if model has not learned anything yet"""
+    state = model.get_state()
+    if len(state) == 0:
+        return False
+
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    np.savez(filepath, **state)
+    return True
+
+
+def load_state(model: BackgroundModel, filepath: str, shape: tuple) -> bool:
+    """Restore model state from .npz file, if it exists and was learned on frames of given shape"""
+    if not os.path.isfile(filepath):
+        return False
+
+    with np.load(filepath) as f:
+        state = {key: f[key] for key in f.files}
+
+    if any(value.shape[-2:] != tuple(shape) for value in state.values() if value.ndim >= 2):
+        return False
+
+    model.set_state(state)
+    return True
@@ -0,0 +1,53 @@
+import math
+import time
+
+
+class LagMonitor:
+    """Estimate of how far a routine, which is called once per camera frame, lags behind the camera
+
+    While the routine keeps up, it is called every frame interval. When a frame takes longer to process,
+    the following frames queue up and calls come in faster than the frame interval until the backlog is
+    worked off. The lag therefore grows by every call interval exceeding the frame interval and shrinks by
+    every call interval which is shorter.
+
+    The frame interval follows the measured call interval while it is within rate_tolerance of the configured one,
+    so a camera running slightly slower than configured does not accumulate lag. The lag additionally decays by
+    decay per call and is capped at max_lag [ms], so that it cannot grow without bound from timer jitter.
+    """
+
+    def __init__(self, frame_rate: float, smoothing: float = 0.9, decay: float = 0.05, max_lag: float = 1000.,
+                 rate_tolerance: float = 0.1, interval_smoothing: float = 0.99):
+        self.nominal_interval = 1000. / frame_rate
+        self.frame_interval = self.nominal_interval
+        self.smoothing = smoothing
+        self.decay = decay
+        self.max_lag = max_lag
+        self.rate_tolerance = rate_tolerance
+        self.interval_smoothing = interval_smoothing
+        # Current lag [ms]
+        self.lag = 0.
+        # Smoothed duration of a full analysis [ms]
+        self.analysis_duration = 0.
+        self._last_call = None
+
+    def frame_started(self, now: float = None) -> float:
+        """Update and return lag [ms] at the start of a routine call (now [s] defaults to time.perf_counter())"""
+        if now is None:
+            now = time.perf_counter()
+        if self._last_call is not None:
+            interval = (now - self._last_call) * 1000
+            # Track the actual camera rate
+            if abs(interval - self.nominal_interval) <= self.rate_tolerance * self.nominal_interval:
+                self.frame_interval = (self.interval_smoothing * self.frame_interval
+                                       + (1. - self.interval_smoothing) * interval)
+            lag = (1. - self.decay) * self.lag + interval - self.frame_interval
+            self.lag = min(max(lag, 0.), self.max_lag)
+        self._last_call = now
+        return self.lag
+
+    def add_analysis_duration(self, duration: float):
+        self.analysis_duration = self.smoothing * self.analysis_duration + (1. - self.smoothing) * duration
+
+    def analysis_interval(self, max_interval: int) -> int:
+        """Smallest interval of fully analysed frames at which analysis keeps up with the camera"""
+        return min(max(math.ceil(self.analysis_duration / self.frame_interval), 1), max_interval)
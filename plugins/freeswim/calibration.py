@@ -0,0 +1,125 @@
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import yaml
+
+# Keys of the camera calibration in its yaml file
+homography_key = 'CALIB_FREESWIM_CAMERA_HOMOGRAPHY'
+camera_matrix_key = 'CALIB_FREESWIM_CAMERA_MATRIX'
+distortion_key = 'CALIB_FREESWIM_CAMERA_DISTORTION'
+
+
+class CameraCalibration:
+    """Mapping of (x, y) camera pixel positions to arena positions [mm]
+
+    Lens distortion is removed first (if camera matrix and distortion coefficients are known),
+    undistorted pixel positions are then projected onto the arena plane by a homography.
+    """
+
+    def __init__(self, homography: np.ndarray, camera_matrix: np.ndarray = None, distortion: np.ndarray = None):
+        self.homography = np.asarray(homography, dtype=np.float64).reshape(3, 3)
+        self.camera_matrix = None if camera_matrix is None else np.asarray(camera_matrix, dtype=np.float64)
+        self.distortion = None if distortion is None else np.asarray(distortion, dtype=np.float64)
+
+    def map_points(self, points: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Map (N, 2) pixel positions to mm, all at once"""
+        if points.shape[0] == 0:
+            return np.zeros((0, 2)) if out is None else out
+
+        points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if self.distortion is not None:
+            points = cv2.undistortPoints(points, self.camera_matrix, self.distortion, P=self.camera_matrix)
+        mapped = cv2.perspectiveTransform(points, self.homography).reshape(-1, 2)
+
+        if out is None:
+            return mapped
+        out[:] = mapped
+        return out
+
+    def error(self, pixel_points: np.ndarray, world_points: np.ndarray) -> float:
+        """Mean distance [mm] between mapped pixel positions and their known arena positions"""
+        mapped = self.map_points(np.asarray(pixel_points, dtype=np.float64))
+        return float(np.linalg.norm(mapped - np.asarray(world_points), axis=1).mean())
+
+    def to_dict(self) -> Dict[str, list]:
+        data = {homography_key: self.homography.tolist()}
+        if self.distortion is not None:
+            data[camera_matrix_key] = self.camera_matrix.tolist()
+            data[distortion_key] = self.distortion.ravel().tolist()
+        return data
+
+
+def fit_points(pixel_points: Sequence[Sequence[float]], world_points: Sequence[Sequence[float]]) \
+        -> CameraCalibration:
+    """Fit homography to 4 or more reference points given as (x, y) pixel positions and (x, y) positions [mm]"""
+    pixel_points = np.asarray(pixel_points, dtype=np.float64)
+    world_points = np.asarray(world_points, dtype=np.float64)
+    if pixel_points.shape[0] < 4 or pixel_points.shape != world_points.shape:
+        raise ValueError('Calibration requires at least 4 pixel positions with corresponding arena positions')
+
+    homography, _ = cv2.findHomography(pixel_points, world_points)
+    if homography is None:
+        raise ValueError('Homography could not be fitted, reference points may be collinear')
+    return CameraCalibration(homography)
+
+
+def fit_checkerboard(frame: np.ndarray, pattern_size: Tuple[int, int], square_size: float,
+                     origin: Tuple[float, float] = (0., 0.)) -> Optional[CameraCalibration]:
+    """Fit lens distortion and homography to a checkerboard lying in the arena plane
+
+    pattern_size is the number of inner corners per row and column, square_size the edge length [mm].
+    Arena positions follow the convention of the calibration rectangle (x to the right, y upwards in the image),
+    origin is the arena position [mm] of the inner corner at the bottom left of the checkerboard.
+    Returns None if no checkerboard is found in the (height, width) grayscale frame.
+    """
+    found, corners = cv2.findChessboardCorners(frame, pattern_size,
+                                               flags=cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    corners = cv2.cornerSubPix(frame, corners, (11, 11), (-1, -1), criteria)
+    # Corners may be detected starting from either end, start with the one at the left of the image
+    if corners[0, 0, 0] > corners[-1, 0, 0]:
+        corners = np.ascontiguousarray(corners[::-1])
+
+    # Rows of corners are detected from the top of the image downwards, arena y points upwards
+    grid = np.mgrid[:pattern_size[0], :pattern_size[1]].T.reshape(-1, 2).astype(np.float32)
+    grid[:, 1] = pattern_size[1] - 1 - grid[:, 1]
+    object_points = np.zeros((pattern_size[0] * pattern_size[1], 3), dtype=np.float32)
+    object_points[:, :2] = grid * square_size + np.asarray(origin, dtype=np.float32)
+
+    # A single view only constrains few intrinsic parameters: fit focal length and radial distortion
+    flags = cv2.CALIB_FIX_PRINCIPAL_POINT | cv2.CALIB_FIX_ASPECT_RATIO | cv2.CALIB_ZERO_TANGENT_DIST \
+        | cv2.CALIB_FIX_K3
+    _, camera_matrix, distortion, _, _ = cv2.calibrateCamera([object_points], [corners], frame.shape[::-1],
+                                                             np.eye(3), None, flags=flags)
+
+    undistorted = cv2.undistortPoints(corners, camera_matrix, distortion, P=camera_matrix)
+    homography, _ = cv2.findHomography(undistorted.reshape(-1, 2), object_points[:, :2])
+    return CameraCalibration(homography, camera_matrix, distortion)
+
+
+def filepath(calibration_path: str) -> str:
+    """File of the camera calibration which belongs to the vxPy calibration file calibration_path"""
+    return f'{os.path.splitext(calibration_path)[0]}_freeswim_camera.yaml'
+
+
+def save(calibration: CameraCalibration, filepath: str):
+    """Write calibration to its own yaml file"""
+    with open(filepath, 'w') as f:
+        yaml.safe_dump(calibration.to_dict(), f)
+
+
+def load(filepath: str) -> Optional[CameraCalibration]:
+    """Read calibration from yaml file, returns None if file contains no camera calibration"""
+    if not os.path.isfile(filepath):
+        return None
+
+    with open(filepath, 'r') as f:
+        data = yaml.safe_load(f) or {}
+
+    if homography_key not in data:
+        return None
+    return CameraCalibration(data[homography_key], data.get(camera_matrix_key), data.get(distortion_key))
@@ -0,0 +1,241 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from plugins.freeswim import arena, background, particles
+
+
+class BlobDetector:
+    """Foreground blob detection on the arena region of (height, width) frames
+
+    With a downsample_factor > 1 background subtraction, smoothing, thresholding and blob labelling run on a
+    downsampled frame. Blob centroids can then be refined on the full resolution frame with refine_centroids.
+
+    With a thread_num > 1 the processing frame is split into thread_num horizontal tiles, which overlap by
+    tile_overlap pixels and are processed in parallel (OpenCV releases the GIL), each with its own background model.
+    Blobs cut by the edge of a tile are discarded, they are fully contained in the neighbouring tile,
+    as long as they are not taller than the overlap.
+    """
+
+    # Minimum absolute difference to background [au] of pixels contributing to refined centroids
+    refine_thresh_val = 15
+    # Overlap between neighbouring tiles in full resolution pixels
+    tile_overlap = 64
+
+    def __init__(self, frame_shape: Tuple[int, int], downsample_factor: int = 1, background_engine: str = 'mog2',
+                 thread_num: int = 1):
+        self.arena = arena.Arena(frame_shape)
+        self.downsample_factor = downsample_factor
+        self.background_engine = background_engine
+        self.thread_num = thread_num
+        self.background_models: List[background.BackgroundModel] = []
+        self._pool = None
+        self._tiles = []
+        self._filtered_buffer = None
+        self._binary_buffer = None
+        self._background_buffer = None
+        self._downsample_buffer = None
+        self._tile_buffers = []
+        self.set_thread_num(thread_num)
+
+    def reset_background(self):
+        """Recreate background model(s) and tiles for current arena, resolution and thread number"""
+        height, width = self.processing_shape
+        tile_num = min(self.thread_num, height)
+        overlap = self.tile_overlap // self.downsample_factor
+
+        # (band start, band stop, core start, core stop) rows of all tiles
+        bounds = np.linspace(0, height, tile_num + 1).astype(int)
+        self._tiles = [(max(start - overlap, 0), min(stop + overlap, height), start, stop)
+                       for start, stop in zip(bounds[:-1], bounds[1:])]
+        self.background_models = [background.create(self.background_engine) for _ in self._tiles]
+
+        # Filtered, binary and label frames of every tile and the downsampled frame, reused on every frame
+        self._tile_buffers = [(np.zeros((stop - start, width), dtype=np.uint8),
+                               np.zeros((stop - start, width), dtype=np.uint8),
+                               np.zeros((stop - start, width), dtype=np.int32)) for start, stop, _, _ in self._tiles]
+        self._downsample_buffer = np.zeros((height, width), dtype=np.uint8) if self.downsample_factor > 1 else None
+
+        if tile_num > 1:
+            self._filtered_buffer = np.zeros((height, width), dtype=np.uint8)
+            self._binary_buffer = np.zeros((height, width), dtype=np.uint8)
+            self._background_buffer = np.zeros((height, width), dtype=np.uint8)
+
+    def set_background_engine(self, name: str):
+        self.background_engine = name
+        self.reset_background()
+
+    def set_downsample_factor(self, factor: int):
+        self.downsample_factor = max(int(factor), 1)
+
+        # Background model is only valid for the resolution it was learned on
+        self.reset_background()
+
+    def set_thread_num(self, thread_num: int):
+        self.thread_num = max(int(thread_num), 1)
+
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self.thread_num > 1:
+            self._pool = ThreadPoolExecutor(self.thread_num, thread_name_prefix='freeswim_tile')
+
+        self.reset_background()
+
+    @property
+    def processing_shape(self) -> Tuple[int, int]:
+        """Shape of the frames the background model is learned on (at least one pixel, even for tiny arenas)"""
+        h, w = self.arena.shape
+        return max(h // self.downsample_factor, 1), max(w // self.downsample_factor, 1)
+
+    @property
+    def background_shapes(self) -> List[Tuple[int, int]]:
+        """Shapes of the frames each background model is learned on"""
+        return [(band_stop - band_start, self.processing_shape[1]) for band_start, band_stop, _, _ in self._tiles]
+
+    def _downsample(self, frame: np.ndarray) -> np.ndarray:
+        f = self.downsample_factor
+        if f == 1:
+            return frame
+
+        # Crop to multiple of factor, so that every coarse pixel covers exactly f x f pixels
+        h, w = self._downsample_buffer.shape
+        return cv2.resize(frame[:h * f, :w * f], (w, h), dst=self._downsample_buffer, interpolation=cv2.INTER_AREA)
+
+    def _process_tile(self, index: int, frame: np.ndarray, ksize: int, binary_thresh_val: int):
+        band_start, band_stop, core_start, core_stop = self._tiles[index]
+        filtered_frame, thresh_frame, labels = self._tile_buffers[index]
+
+        # Calculate background distribution and foreground mask
+        foreground_mask = self.background_models[index].apply(frame[band_start:band_stop])
+
+        # Smooth mask
+        cv2.GaussianBlur(foreground_mask, (ksize, ksize), cv2.BORDER_DEFAULT, dst=filtered_frame)
+
+        # Apply threshold and remove everything outside of arena polygon
+        cv2.threshold(filtered_frame, binary_thresh_val, 255, cv2.THRESH_BINARY, dst=thresh_frame)
+        mask = self.arena.scaled_mask(frame.shape)
+        if mask is not None:
+            cv2.bitwise_and(thresh_frame, mask[band_start:band_stop], dst=thresh_frame)
+
+        areas, centroids, boxes = particles.detect_blobs(thresh_frame, labels)
+        if len(self._tiles) == 1:
+            return filtered_frame, thresh_frame, areas, centroids
+
+        # Keep core rows for debug frames
+        core = slice(core_start - band_start, core_stop - band_start)
+        self._filtered_buffer[core_start:core_stop] = filtered_frame[core]
+        self._binary_buffer[core_start:core_stop] = thresh_frame[core]
+
+        # Only keep blobs with centroid in core, which are not cut by an edge shared with another tile
+        rows = centroids[:, 1] + band_start
+        keep = (rows >= core_start) & (rows < core_stop)
+        if band_start > 0:
+            keep &= boxes[:, 1] > 0
+        if band_stop < frame.shape[0]:
+            keep &= boxes[:, 1] + boxes[:, 3] < band_stop - band_start
+
+        return None, None, areas[keep], centroids[keep] + np.array([0, band_start])
+
+    def apply(self, frame: np.ndarray, filter_size: int, binary_thresh_val: int) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Update background model and detect foreground blobs
+
+        Returns the filtered and the binary frame (arena region at processing resolution)
+        as well as areas and (x, y) full-frame centroids of all blobs, both in full resolution pixel units.
+        """
+        f = self.downsample_factor
+        processing_frame = self._downsample(self.arena.crop(frame))
+
+        # Filter size is given in full resolution pixels and needs to stay odd
+        ksize = max(filter_size // f // 2 * 2 + 1, 1)
+
+        if len(self._tiles) == 1:
+            filtered_frame, thresh_frame, areas, centroids = self._process_tile(0, processing_frame, ksize,
+                                                                                binary_thresh_val)
+        else:
+            results = list(self._pool.map(lambda i: self._process_tile(i, processing_frame, ksize, binary_thresh_val),
+                                          range(len(self._tiles))))
+            filtered_frame, thresh_frame = self._filtered_buffer, self._binary_buffer
+            areas = np.concatenate([r[2] for r in results])
+            centroids = np.concatenate([r[3] for r in results])
+
+        if f > 1:
+            areas = areas * f ** 2
+            centroids = (centroids + 0.5) * f - 0.5
+
+        return filtered_frame, thresh_frame, areas, self.arena.to_full_frame(centroids)
+
+    def background_image(self) -> np.ndarray:
+        """Current background estimate of the arena region at processing resolution"""
+        if len(self.background_models) == 1:
+            return self.background_models[0].background_image()
+
+        for model, (band_start, _, core_start, core_stop) in zip(self.background_models, self._tiles):
+            image = model.background_image()
+            if image is None:
+                return None
+            if image.ndim > 2:
+                image = image[:, :, 0]
+            self._background_buffer[core_start:core_stop] = image[core_start - band_start:core_stop - band_start]
+
+        return self._background_buffer
+
+    def save_background(self, filepath: str) -> bool:
+        """Save background model state(s) to .npz file(s), tile index is appended to filepath for tiled processing"""
+        if len(self.background_models) == 1:
+            return background.save_state(self.background_models[0], f'{filepath}.npz')
+        return all([background.save_state(model, f'{filepath}_tile{i}of{len(self._tiles)}.npz')
+                    for i, model in enumerate(self.background_models)])
+
+    def load_background(self, filepath: str) -> bool:
+        """Restore background model state(s) saved with save_background"""
+        if len(self.background_models) == 1:
+            return background.load_state(self.background_models[0], f'{filepath}.npz', self.processing_shape)
+        return all([background.load_state(model, f'{filepath}_tile{i}of{len(self._tiles)}.npz', shape)
+                    for i, (model, shape) in enumerate(zip(self.background_models, self.background_shapes))])
+
+    def refine_centroids(self, frame: np.ndarray, centroids: np.ndarray, window: Tuple[int, int]) -> np.ndarray:
+        """Refine coarse (x, y) centroids on the full resolution frame
+
+        Centroids are recalculated from the background difference within a window around each coarse centroid.
+        """
+        f = self.downsample_factor
+        if f == 1 or centroids.shape[0] == 0:
+            return centroids
+
+        arena_frame = self.arena.crop(frame)
+        background_image = self.background_image()
+        if background_image is None:
+            return centroids
+        if background_image.ndim > 2:
+            background_image = background_image[:, :, 0]
+
+        refined = centroids.astype(np.float64)
+        half = np.array(window) // 2
+        upper = np.array(background_image.shape[::-1]) * f
+        for k, local in enumerate(centroids - self.arena.offset):
+            # Window bounds on coarse pixel grid
+            x0, y0 = np.clip((local - half) // f * f, 0, upper).astype(int)
+            x1, y1 = np.clip(-(-(local + half) // f) * f, 0, upper).astype(int)
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            background_patch = cv2.resize(background_image[y0 // f:y1 // f, x0 // f:x1 // f], (x1 - x0, y1 - y0),
+                                          interpolation=cv2.INTER_LINEAR)
+            diff = cv2.absdiff(arena_frame[y0:y1, x0:x1], background_patch)
+            _, diff = cv2.threshold(diff, self.refine_thresh_val, 255, cv2.THRESH_TOZERO)
+
+            M = cv2.moments(diff)
+            if M['m00'] > 0:
+                refined[k] = self.arena.to_full_frame(np.array([M['m10'] / M['m00'] + x0, M['m01'] / M['m00'] + y0]))
+
+        return refined
+
+    def paste(self, arena_frame: np.ndarray, full_frame: np.ndarray) -> np.ndarray:
+        """Write processing resolution arena frame into its region of a full sized frame"""
+        if self.downsample_factor > 1:
+            arena_frame = cv2.resize(arena_frame, self.arena.shape[::-1], interpolation=cv2.INTER_NEAREST)
+        return self.arena.paste(arena_frame, full_frame)
@@ -0,0 +1,87 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+class IdentityTracker:
+    """Online assignment of per-frame detections to persistent tracks
+
+    Every track occupies a fixed slot, so row k of the output always belongs to the same fish for as long as
+    its track lives. Track positions are predicted with a constant velocity model and matched to detections by
+    optimal assignment on the distance matrix. Tracks which are not matched for more than max_missed frames
+    are dropped and their slot is freed for new detections.
+    """
+
+    def __init__(self, slot_num: int, max_distance: float = 50., max_missed: int = 10, velocity_smoothing: float = 0.5):
+        self.slot_num = slot_num
+        # Maximum distance between predicted and detected position for an assignment [px]
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.velocity_smoothing = velocity_smoothing
+
+        self.positions = np.zeros((slot_num, 2))
+        self.velocities = np.zeros((slot_num, 2))
+        self.ids = np.zeros(slot_num, dtype=np.uint64)
+        self.missed = np.zeros(slot_num, dtype=np.int64)
+        # Slots which were matched to a detection in the last update
+        self.observed = np.zeros(slot_num, dtype=bool)
+        # Track id of every detection of the last update (0 if it was not assigned to a track)
+        self.detection_ids = np.zeros(0, dtype=np.uint64)
+        self._next_id = 1
+
+    def reset(self):
+        self.positions[:] = 0
+        self.velocities[:] = 0
+        self.ids[:] = 0
+        self.missed[:] = 0
+        self.observed[:] = False
+
+    def predict(self):
+        """Advance all tracks by their velocity, for frames which are not analysed (tracks are not counted as missed)"""
+        active = self.ids > 0
+        self.positions[active] += self.velocities[active]
+        self.observed[:] = False
+
+    def update(self, detections: np.ndarray):
+        """Assign (M, 2) detected positions to tracks"""
+        self.observed[:] = False
+        self.detection_ids = np.zeros(detections.shape[0], dtype=np.uint64)
+        active = np.flatnonzero(self.ids > 0)
+        predicted = self.positions[active] + self.velocities[active]
+        unassigned = np.ones(detections.shape[0], dtype=bool)
+
+        if active.shape[0] > 0 and detections.shape[0] > 0:
+            cost = np.linalg.norm(predicted[:, None, :] - detections[None, :, :], axis=-1)
+            rows, cols = linear_sum_assignment(cost)
+            valid = cost[rows, cols] <= self.max_distance
+            rows, cols = rows[valid], cols[valid]
+
+            slots = active[rows]
+            new_positions = detections[cols]
+            self.velocities[slots] = self.velocity_smoothing * self.velocities[slots] \
+                + (1. - self.velocity_smoothing) * (new_positions - self.positions[slots])
+            self.positions[slots] = new_positions
+            self.observed[slots] = True
+            self.detection_ids[cols] = self.ids[slots]
+            unassigned[cols] = False
+
+        # Coast unmatched tracks on their prediction and drop those which were missed for too long
+        coasting = self.ids > 0
+        coasting[self.observed] = False
+        self.positions[coasting] += self.velocities[coasting]
+        self.missed[coasting] += 1
+        self.missed[self.observed] = 0
+        lost = coasting & (self.missed > self.max_missed)
+        self.ids[lost] = 0
+        self.velocities[lost] = 0
+
+        # Start new tracks for unmatched detections in free slots
+        new_detections = detections[unassigned]
+        free = np.flatnonzero(self.ids == 0)[:new_detections.shape[0]]
+        new_num = free.shape[0]
+        self.positions[free] = new_detections[:new_num]
+        self.velocities[free] = 0
+        self.missed[free] = 0
+        self.observed[free] = True
+        self.ids[free] = np.arange(self._next_id, self._next_id + new_num, dtype=np.uint64)
+        self.detection_ids[np.flatnonzero(unassigned)[:new_num]] = self.ids[free]
+        self._next_id += new_num
@@ -0,0 +1,85 @@
+from typing import Sequence
+
+import numpy as np
+
+
+class KinematicsAccumulator:
+    """Occupancy, speed and heading statistics of identity tracks, updated incrementally every frame
+
+    Positions are given in mm within (0, 0) to extent, speeds are calculated between consecutive frames in which
+    the same track was observed. Each update costs O(tracks), no samples are kept.
+    The occupancy grid is fixed to extent, positions outside of it are only counted in outside_count.
+    """
+
+    def __init__(self, extent: Sequence[float], bin_size: float = 2., max_speed: float = 100., speed_bin_num: int = 50,
+                 heading_bin_num: int = 36, slot_num: int = 10):
+        self.extent = np.asarray(extent, dtype=np.float64)
+        self.bin_size = bin_size
+        self.max_speed = max_speed
+        # Occupancy in (x, y) bins, like all output frames
+        self.occupancy = np.zeros(np.ceil(self.extent / bin_size).astype(int), dtype=np.uint32)
+        self.speed_histogram = np.zeros(speed_bin_num, dtype=np.uint32)
+        self.heading_histogram = np.zeros(heading_bin_num, dtype=np.uint32)
+        # Speed sample count, mean [mm/s] and sum of squared deviations (Welford)
+        self.speed_count = 0
+        self.speed_mean = 0.
+        self._speed_m2 = 0.
+        # Observed positions which were outside of the occupancy grid
+        self.outside_count = 0
+
+        self._last_positions = -np.ones((slot_num, 2))
+        self._last_ids = np.zeros(slot_num, dtype=np.uint64)
+        self._last_time = None
+
+    def reset(self):
+        self.occupancy[:] = 0
+        self.speed_histogram[:] = 0
+        self.heading_histogram[:] = 0
+        self.speed_count = 0
+        self.speed_mean = 0.
+        self._speed_m2 = 0.
+        self.outside_count = 0
+        self._last_ids[:] = 0
+        self._last_time = None
+
+    @property
+    def vertical_histogram(self) -> np.ndarray:
+        """Occupancy along the vertical (y) axis"""
+        return self.occupancy.sum(axis=0, dtype=np.uint64)
+
+    @property
+    def speed_std(self) -> float:
+        return float(np.sqrt(self._speed_m2 / self.speed_count)) if self.speed_count > 1 else 0.
+
+    def update(self, tracks: np.ndarray, ids: np.ndarray, frame_time: float):
+        """Add (slot_num, 2) track positions [mm] (negative for tracks without position) with their ids"""
+        observed = (ids > 0) & np.all(tracks >= 0, axis=1)
+
+        # Occupancy
+        bins = (tracks[observed] / self.bin_size).astype(int)
+        inside = np.all((bins >= 0) & (bins < self.occupancy.shape), axis=1)
+        np.add.at(self.occupancy, (bins[inside, 0], bins[inside, 1]), 1)
+        self.outside_count += int(np.count_nonzero(~inside))
+
+        # Speed and heading of tracks which were observed in the previous frame
+        if self._last_time is not None and frame_time > self._last_time:
+            continued = observed & (ids == self._last_ids) & np.all(self._last_positions >= 0, axis=1)
+            displacements = tracks[continued] - self._last_positions[continued]
+            speeds = np.linalg.norm(displacements, axis=1) / (frame_time - self._last_time)
+            headings = np.arctan2(displacements[:, 1], displacements[:, 0])
+
+            speed_bins = (speeds / self.max_speed * self.speed_histogram.shape[0]).astype(int)
+            np.add.at(self.speed_histogram, np.minimum(speed_bins, self.speed_histogram.shape[0] - 1), 1)
+            heading_bins = ((headings + np.pi) / (2 * np.pi) * self.heading_histogram.shape[0]).astype(int)
+            np.add.at(self.heading_histogram, heading_bins % self.heading_histogram.shape[0], 1)
+
+            for speed in speeds:
+                self.speed_count += 1
+                delta = speed - self.speed_mean
+                self.speed_mean += delta / self.speed_count
+                self._speed_m2 += delta * (speed - self.speed_mean)
+
+        self._last_positions[:] = -1
+        self._last_positions[observed] = tracks[observed]
+        self._last_ids[:] = ids
+        self._last_time = frame_time
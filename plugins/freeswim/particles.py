@@ -0,0 +1,58 @@
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+def detect_blobs(binary: np.ndarray, labels: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Label all blobs in a binary frame in a single call
+
+    Returns areas (N,), centroids (N, 2) and bounding boxes (N, 4) of all N blobs.
+    Centroids and boxes are given in OpenCV point order, i.e. (column, row) and (column, row, width, height).
+    labels is an optional int32 buffer of the frame's shape for the label image.
+    """
+    _, _, stats, centroids = cv2.connectedComponentsWithStats(binary, labels=labels, connectivity=8,
+                                                              ltype=cv2.CV_32S)
+
+    # Label 0 is the background
+    return stats[1:, cv2.CC_STAT_AREA], centroids[1:], stats[1:, :4]
+
+
+def select_particles(areas: np.ndarray, centroids: np.ndarray, min_area: int, max_number: int = None,
+                     lower_bound: np.ndarray = None, upper_bound: np.ndarray = None) -> Tuple[np.ndarray, int]:
+    """Filter blobs by area and centroid bounds and rank the survivors by descending area
+
+    Returns the indices of at most max_number (default: all) selected blobs and the number of blobs which passed
+    the filters.
+    """
+    valid = areas >= min_area
+    if lower_bound is not None:
+        valid &= np.all(centroids >= lower_bound, axis=1)
+    if upper_bound is not None:
+        valid &= np.all(centroids < upper_bound, axis=1)
+    selected = np.flatnonzero(valid)
+    valid_count = selected.shape[0]
+
+    # Only the largest max_number blobs need to be ordered
+    if max_number is not None and valid_count > max_number:
+        selected = selected[np.argpartition(areas[selected], -max_number)[-max_number:]]
+
+    return selected[np.argsort(areas[selected])[::-1]], valid_count
+
+
+def crop_rois(frame: np.ndarray, centers: np.ndarray, rect_size: Tuple[int, int], out: np.ndarray) -> np.ndarray:
+    """Cut rect_size (width, height) ROIs around (N, 2) integer (x, y) centers of a (height, width) frame
+
+    All ROIs are gathered in one indexing operation. ROIs extending beyond the frame are padded by repeating
+    the edge pixels. ROIs are written to out[:N] in (width, height) layout, like all output frames.
+    """
+    n = centers.shape[0]
+    if n == 0:
+        return out[:0]
+
+    xdiff, ydiff = rect_size[0] // 2, rect_size[1] // 2
+    cols = np.clip(centers[:, 0, None] + np.arange(-xdiff, rect_size[0] - xdiff), 0, frame.shape[1] - 1)
+    rows = np.clip(centers[:, 1, None] + np.arange(-ydiff, rect_size[1] - ydiff), 0, frame.shape[0] - 1)
+    out[:n] = frame[rows[:, None, :], cols[:, :, None]]
+
+    return out[:n]
@@ -0,0 +1,221 @@
+import multiprocessing
+from typing import Any, Dict, List, Tuple
+
+import h5py
+import numpy as np
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+# Target size of a chunk of item datasets [bytes]
+chunk_size = 2 ** 20
+
+
+def compression_options() -> Dict[str, Any]:
+    """Dataset options of the fastest available compression filter: Blosc LZ4 if hdf5plugin is installed, else gzip"""
+    if hdf5plugin is not None:
+        return dict(hdf5plugin.Blosc(cname='lz4', clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    return {'compression': 'gzip', 'compression_opts': 1}
+
+
+class RaggedWriter:
+    """Append a variable number of items per frame to an HDF5 group
+
+    Items of all frames are concatenated along the first axis of one dataset per field. Dataset 'offsets' holds the
+    index of the first item of every frame plus the total number of items, so that the items of frame i are
+    data[offsets[i]:offsets[i + 1]]. Dataset 'time' holds the time of every frame.
+
+    Frames are collected in memory and written in blocks of block_frames frames.
+
+    Item datasets are chunked along the item axis only, so that every chunk holds whole items of consecutive frames
+    (about chunk_size bytes). Items keep the order in which they were appended, chunks are not grouped by identity.
+    If id_field is given, close() writes group 'id_index' with the item indices of every id (datasets 'ids',
+    'offsets' and 'items', like the frame offsets), so that the items of one identity (e.g. a fish) are read without
+    scanning (see RaggedReader.read_ids).
+
+    Fields listed in compressed_fields are compressed with the given dataset options (default: compression_options()).
+    """
+
+    def __init__(self, group: h5py.Group, fields: Dict[str, Tuple[tuple, np.dtype]], block_frames: int = 256,
+                 compressed_fields: List[str] = (), compression: Dict[str, Any] = None, id_field: str = None):
+        self.group = group
+        self.fields = {name: (tuple(shape), np.dtype(dtype)) for name, (shape, dtype) in fields.items()}
+        self.block_frames = block_frames
+        self.id_field = id_field
+        # Ids of all written items, for the id index
+        self._ids = []
+
+        self.group.create_dataset('offsets', data=np.zeros(1, dtype=np.uint64), maxshape=(None,), chunks=(4096,))
+        self.group.create_dataset('time', shape=(0,), dtype=np.float64, maxshape=(None,), chunks=(4096,))
+        if compression is None:
+            compression = compression_options()
+        for name, (shape, dtype) in self.fields.items():
+            chunk_items = max(chunk_size // (int(np.prod(shape)) * dtype.itemsize), 1)
+            options = compression if name in compressed_fields else {}
+            self.group.create_dataset(name, shape=(0, *shape), dtype=dtype, maxshape=(None, *shape),
+                                      chunks=(chunk_items, *shape), **options)
+
+        self._frame_num = 0
+        self._item_num = 0
+        self._times = np.zeros(block_frames, dtype=np.float64)
+        self._counts = np.zeros(block_frames, dtype=np.uint64)
+        self._block_frame_num = 0
+        self._block_item_num = 0
+        self._buffers = {name: np.zeros((block_frames, *shape), dtype=dtype)
+                         for name, (shape, dtype) in self.fields.items()}
+
+    def append(self, frame_time: float, **items: np.ndarray):
+        """Add items of one frame, all fields need to be given with the same number of items"""
+        count = next(iter(items.values())).shape[0]
+        end = self._block_item_num + count
+
+        # Grow item buffers if frames in this block have more items than expected
+        for name, buffer in self._buffers.items():
+            if end > buffer.shape[0]:
+                grown = np.zeros((max(end, 2 * buffer.shape[0]), *buffer.shape[1:]), dtype=buffer.dtype)
+                grown[:self._block_item_num] = buffer[:self._block_item_num]
+                self._buffers[name] = buffer = grown
+            buffer[self._block_item_num:end] = items[name]
+
+        self._times[self._block_frame_num] = frame_time
+        self._counts[self._block_frame_num] = count
+        self._block_frame_num += 1
+        self._block_item_num = end
+
+        if self._block_frame_num == self.block_frames:
+            self.flush()
+
+    def flush(self):
+        frame_num, item_num = self._block_frame_num, self._block_item_num
+        if frame_num == 0:
+            return
+
+        offsets = self.group['offsets']
+        offsets.resize((self._frame_num + frame_num + 1,))
+        offsets[self._frame_num + 1:] = self._item_num + np.cumsum(self._counts[:frame_num])
+        times = self.group['time']
+        times.resize((self._frame_num + frame_num,))
+        times[self._frame_num:] = self._times[:frame_num]
+
+        for name, buffer in self._buffers.items():
+            dataset = self.group[name]
+            dataset.resize((self._item_num + item_num, *dataset.shape[1:]))
+            dataset[self._item_num:] = buffer[:item_num]
+        if self.id_field is not None:
+            self._ids.append(self._buffers[self.id_field][:item_num].copy())
+
+        self._frame_num += frame_num
+        self._item_num += item_num
+        self._block_frame_num = 0
+        self._block_item_num = 0
+
+    def close(self):
+        """Write remaining frames and the id index"""
+        self.flush()
+        if self.id_field is None:
+            return
+
+        ids = np.concatenate(self._ids) if self._ids else np.zeros(0, dtype=self.fields[self.id_field][1])
+        items = np.argsort(ids, kind='stable')
+        unique_ids, counts = np.unique(ids, return_counts=True)
+        index = self.group.create_group('id_index')
+        index.create_dataset('ids', data=unique_ids)
+        index.create_dataset('offsets', data=np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64))
+        index.create_dataset('items', data=items.astype(np.uint64))
+
+
+def _write_process(filepath: str, fields: Dict[str, Tuple[tuple, np.dtype]], writer_kwargs: Dict[str, Any],
+                   queue: multiprocessing.Queue):
+    with h5py.File(filepath, 'w') as f:
+        writer = RaggedWriter(f, fields, **writer_kwargs)
+        while True:
+            frames = queue.get()
+            if frames is None:
+                break
+            for frame_time, items in frames:
+                writer.append(frame_time, **items)
+        writer.close()
+
+
+class BackgroundRaggedWriter:
+    """RaggedWriter in a separate process, so that compression and file access do not block the caller
+
+    Frames are sent to the writing process in batches of batch_frames frames.
+    """
+
+    def __init__(self, filepath: str, fields: Dict[str, Tuple[tuple, np.dtype]], batch_frames: int = 32,
+                 **writer_kwargs):
+        self.filepath = filepath
+        self.batch_frames = batch_frames
+        self._batch = []
+
+        # Spawn a fresh interpreter, HDF5 state must not be inherited from the calling process
+        context = multiprocessing.get_context('spawn')
+        self._queue = context.Queue()
+        self._process = context.Process(target=_write_process, args=(filepath, fields, writer_kwargs, self._queue),
+                                        name='ragged_writer', daemon=True)
+        self._process.start()
+
+    def append(self, frame_time: float, **items: np.ndarray):
+        # Copy items, they may be views on buffers which are reused by the caller
+        self._batch.append((frame_time, {name: np.array(values) for name, values in items.items()}))
+        if len(self._batch) >= self.batch_frames:
+            self._queue.put(self._batch)
+            self._batch = []
+
+    def close(self):
+        """Send remaining frames and wait for the writing process to finish the file"""
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._queue.put(None)
+        self._process.join()
+
+
+class RaggedReader:
+    """Random access by frame index to items written with RaggedWriter"""
+
+    def __init__(self, group: h5py.Group):
+        self.group = group
+        # Offset index is small, keep it in memory
+        self.offsets = group['offsets'][:]
+        self.time = group['time']
+
+    def __len__(self) -> int:
+        return self.offsets.shape[0] - 1
+
+    @property
+    def counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def read(self, name: str, frame_index: int) -> np.ndarray:
+        """Return all items of field name in frame frame_index"""
+        return self.group[name][self.offsets[frame_index]:self.offsets[frame_index + 1]]
+
+    def read_range(self, name: str, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return items of frames start to stop in one read and their offsets relative to the returned items"""
+        offsets = self.offsets[start:stop + 1]
+        return self.group[name][offsets[0]:offsets[-1]], offsets - offsets[0]
+
+    def read_ids(self, name: str, id_field: str, item_id: int, start: int, stop: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return items of field name in frames start to stop whose id_field equals item_id, and their frame indices
+
+        Only the items of item_id are read if the file has an id index, otherwise id_field is scanned.
+        """
+        if 'id_index' in self.group:
+            index = self.group['id_index']
+            k = np.searchsorted(index['ids'][:], item_id)
+            if k == index['ids'].shape[0] or index['ids'][k] != item_id:
+                return self.group[name][:0], np.zeros(0, dtype=np.int64)
+            items = index['items'][index['offsets'][k]:index['offsets'][k + 1]].astype(np.int64)
+            items = items[(items >= self.offsets[start]) & (items < self.offsets[stop])]
+            frame_indices = np.searchsorted(self.offsets, items, side='right') - 1
+            return self.group[name][items], frame_indices
+
+        ids, offsets = self.read_range(id_field, start, stop)
+        selected = np.flatnonzero(ids == item_id)
+        items, _ = self.read_range(name, start, stop)
+        frame_indices = start + np.searchsorted(offsets, selected, side='right') - 1
+        return items[selected], frame_indices
@@ -0,0 +1,147 @@
+import time
+from typing import Tuple
+
+import numpy as np
+
+from plugins.freeswim import detection, identity, particles
+
+
+class FreeswimTracker:
+    """Per-frame analysis of the freeswim tracker, shared by FreeswimTrackerRoutine and offline reprocessing
+
+    Processing parameters are read from params on every frame. params can be any object with the attributes
+    rect_size, max_particle_number, dimension_size, binary_thresh_val, min_area, filter_size,
+    calibration_rect_pos, calibration_rect_size and camera_calibration (e.g. the routine itself).
+    Pixel positions are mapped to mm with camera_calibration if it is set, otherwise by linear scaling of
+    the calibration rectangle to dimension_size.
+
+    Results of the last processed frame are kept in output buffers which are reused in place.
+    Every blob which passes min_area is a particle, rois and positions grow as needed and hold particles in order
+    of descending area. Their first max_particle_number rows fill the fixed-size vxPy attributes.
+    """
+
+    # Processing stages, durations [ms] of the last processed frame are kept in stage_durations
+    stage_names = ('detection', 'selection', 'refinement', 'identity', 'output')
+
+    def __init__(self, frame_shape: Tuple[int, int], params, downsample_factor: int = 1,
+                 background_engine: str = 'mog2', thread_num: int = 1,
+                 track_max_distance: float = 50., track_max_missed: int = 10):
+        self.frame_shape = frame_shape
+        self.params = params
+        max_particle_number = params.max_particle_number
+
+        self.detector = detection.BlobDetector(frame_shape, downsample_factor, background_engine, thread_num)
+        # Identity tracker, keeps each fish in the same row of tracks
+        self.identity_tracker = identity.IdentityTracker(max_particle_number, track_max_distance, track_max_missed)
+
+        # Outputs (dtypes match the respective attributes)
+        self.filtered_frame: np.ndarray = None
+        self.binary_frame: np.ndarray = None
+        self.count_total = 0
+        self.count_filtered = 0
+        self.pixel_positions = np.zeros((0, 2), dtype=np.int64)
+        # Track id of every selected particle
+        self.particle_track_ids = np.zeros(0, dtype=np.uint64)
+        self.rois = np.zeros((max_particle_number, *params.rect_size), dtype=np.uint8)
+        self.positions = -np.ones((max_particle_number, 2), dtype=np.float64)
+        self.tracks = -np.ones((max_particle_number, 2), dtype=np.float64)
+        self.stage_durations = np.zeros(len(self.stage_names), dtype=np.float64)
+
+    @property
+    def padded_rois(self) -> np.ndarray:
+        """ROIs of the largest max_particle_number particles, unused rows cleared"""
+        return self.rois[:self.params.max_particle_number]
+
+    @property
+    def padded_positions(self) -> np.ndarray:
+        """Positions [mm] of the largest max_particle_number particles, unused rows -1"""
+        return self.positions[:self.params.max_particle_number]
+
+    def _stage_done(self, index: int, start: float) -> float:
+        now = time.perf_counter()
+        self.stage_durations[index] = (now - start) * 1000
+        return now
+
+    def apply_dimensions(self, points: np.ndarray, out: np.ndarray) -> np.ndarray:
+        # Map (N, 2) pixel positions to mm
+        p = self.params
+        if p.camera_calibration is not None:
+            return p.camera_calibration.map_points(points, out)
+
+        np.subtract(points, p.calibration_rect_pos, out=out)
+        out /= p.calibration_rect_size
+        out *= p.dimension_size
+        np.subtract(p.dimension_size[1], out[:, 1], out=out[:, 1])
+
+        return out
+
+    def process(self, frame: np.ndarray) -> int:
+        """Analyse (height, width) frame and return the number of selected particles"""
+        p = self.params
+        t = time.perf_counter()
+
+        # Update background model and detect all foreground blobs in arena
+        self.filtered_frame, self.binary_frame, areas, centroids = self.detector.apply(frame, p.filter_size,
+                                                                                       p.binary_thresh_val)
+        t = self._stage_done(0, t)
+
+        # Select all blobs by descending area (ROIs at the frame edge are padded, so blobs anywhere are kept)
+        selected, self.count_filtered = particles.select_particles(areas, centroids, p.min_area)
+        self.count_total = areas.shape[0]
+        t = self._stage_done(1, t)
+
+        # Refine coarse centroids of selected blobs on full resolution frame
+        selected_centroids = self.detector.refine_centroids(frame, centroids[selected], p.rect_size)
+        selected_centroids = np.clip(selected_centroids, 0, np.array(frame.shape[::-1]) - 1)
+        t = self._stage_done(2, t)
+
+        # Assign particles to tracks (-1 for tracks without particle in this frame)
+        self.identity_tracker.update(selected_centroids)
+        observed = self.identity_tracker.observed
+        self.tracks[:] = -1
+        self.tracks[observed] = self.apply_dimensions(self.identity_tracker.positions[observed],
+                                                      self.tracks[observed])
+        t = self._stage_done(3, t)
+
+        return self._update_particles(frame, selected_centroids, self.identity_tracker.detection_ids, t)
+
+    def predict(self, frame: np.ndarray) -> int:
+        """Advance tracks by their velocity without analysing frame, particles are taken from the predicted tracks
+
+        Particle counts and debug frames keep the values of the last analysed frame.
+        """
+        self.stage_durations[:] = 0
+        t = time.perf_counter()
+
+        self.identity_tracker.predict()
+        active = self.identity_tracker.ids > 0
+        self.tracks[:] = -1
+        self.tracks[active] = self.apply_dimensions(self.identity_tracker.positions[active], self.tracks[active])
+        t = self._stage_done(3, t)
+
+        predicted = np.clip(self.identity_tracker.positions[active], 0, np.array(frame.shape[::-1]) - 1)
+
+        return self._update_particles(frame, predicted, self.identity_tracker.ids[active], t)
+
+    def _update_particles(self, frame: np.ndarray, centroids: np.ndarray, track_ids: np.ndarray, t: float) -> int:
+        self.pixel_positions = centroids.astype(np.int64)
+        self.particle_track_ids = track_ids
+        particle_num = self.pixel_positions.shape[0]
+        if particle_num > self.rois.shape[0]:
+            capacity = max(particle_num, 2 * self.rois.shape[0])
+            self.rois = np.zeros((capacity, *self.rois.shape[1:]), dtype=self.rois.dtype)
+            self.positions = -np.ones((capacity, 2), dtype=self.positions.dtype)
+
+        # Map positions of all particles at once and clear unused rows
+        self.positions[particle_num:] = -1
+        self.rois[particle_num:] = 0
+        if particle_num == 0:
+            self._stage_done(4, t)
+            return 0
+        self.apply_dimensions(self.pixel_positions, self.positions[:particle_num])
+
+        # Crop all rectangular ROIs at once
+        particles.crop_rois(frame, self.pixel_positions, self.params.rect_size, self.rois)
+        self._stage_done(4, t)
+
+        return particle_num
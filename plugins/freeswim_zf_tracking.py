@@ -1,3 +1,5 @@
+import atexit
+import os
 from typing import Tuple
 
 import cv2
@@ -11,10 +13,16 @@ from vxpy.api.attribute import write_to_file
 import vxpy.core.attribute as vxattribute
 import vxpy.core.gui as vxgui
 import vxpy.core.ipc as vxipc
+import vxpy.core.logger as vxlogger
 import vxpy.core.routine as vxroutine
 from vxpy.definitions import *
 from vxpy.utils import widgets
 
+from plugins.common import display, timing
+from plugins.freeswim import autotune, background, backpressure, calibration, kinematics, ragged, tracker
+
+log = vxlogger.getLogger(__name__)
+
 
 class RoiView(pg.GraphicsLayoutWidget):
     def __init__(self, parent, **kwargs):
@@ -31,20 +39,57 @@ class RoiView(pg.GraphicsLayoutWidget):
         self.image_plot.invertY(True)
         self.image_plot.addItem(self.image_item)
 
+        # Last displayed index of particle_rois, stacking buffer of valid ROIs and GUI frame time (debug overlay).
+        # Live ROIs are the largest max_particle_number particles, all particles are only in the ragged recording
+        self._attribute = None
+        self._count_attribute = None
+        self._last_index = None
+        self._stack = None
+        self.frame_time = display.FrameTimeOverlay(self.image_plot.vb)
+
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self._update_image)
         self.timer.setInterval(50)
         self.timer.start()
 
+    def set_frame_time_visible(self, visible):
+        self.frame_time.set_visible(visible)
+
     def _update_image(self):
-        # Read last frame
-        idx, time, frame = vxattribute.read_attribute('particle_rois')
+        self.frame_time.start()
+        if self._attribute is None:
+            self._attribute = vxattribute.get_attribute('particle_rois')
+            self._count_attribute = vxattribute.get_attribute('particle_count_selected')
+            if self._attribute is None or self._count_attribute is None:
+                return
+
+        # Skip polls without new ROIs
+        index = self._attribute.index - 1
+        if index < 0 or index == self._last_index:
+            return
 
-        if idx[0] is None:
+        # Read last ROIs and the number of valid ROIs of the same frame (both are written once per frame)
+        idx, time, frame = self._attribute[index]
+        count_idx, _, count = self._count_attribute[index]
+        if idx[0] != index or count_idx[0] != index:
             return
+        self._last_index = index
+        if int(count[0][0]) == 0:
+            self.image_item.clear()
+            return
+        rois = frame[0][:int(count[0][0])]
+
+        # Stack ROIs along the first axis into a reused buffer
+        shape = (frame[0].shape[0] * frame[0].shape[1], *frame[0].shape[2:])
+        if self._stack is None or self._stack.shape != shape:
+            self._stack = np.zeros(shape, dtype=frame[0].dtype)
+        stack = self._stack[:rois.shape[0] * rois.shape[1]]
+        stack.reshape(rois.shape)[:] = rois
 
         # Set frame data on image plot
-        self.image_item.setImage(np.vstack(frame[0]))
+        self.image_item.setImage(display.downsample(stack, display.screen_size(self.image_plot.vb, stack.shape)))
+        self.image_item.setRect(QtCore.QRectF(0, 0, stack.shape[0], stack.shape[1]))
+        self.frame_time.stop()
 
 
 class Roi(pg.RectROI):
@@ -83,6 +128,9 @@ class FrameView(pg.GraphicsLayoutWidget):
         self._calibrate = False
         self._points = []
         self._attribute = None
+        self._last_index = None
+        # Occupancy has its y axis [mm] pointing up, the view's y axis points down
+        self._flip_y = False
 
         # Set up plot image item
         self.image_plot = self.addPlot(0, 0, 1, 10)
@@ -97,6 +145,20 @@ class FrameView(pg.GraphicsLayoutWidget):
         self.rect_roi = Roi()
         self.image_plot.vb.addItem(self.rect_roi)
 
+        # Add tank polygon ROI
+        self.polygon_roi = pg.PolyLineROI([[0, 0], [200, 0], [200, 200], [0, 200]], closed=True,
+                                          pen=pg.mkPen(color='cyan', width=2))
+        self.polygon_roi.hide()
+        self.image_plot.vb.addItem(self.polygon_roi)
+
+        # Reference points for camera calibration as ((x, y) pixel position, (x, y) arena position [mm])
+        self.point_markers = pg.ScatterPlotItem(size=10, pen=pg.mkPen(color='magenta', width=2), brush=None)
+        self.image_plot.vb.addItem(self.point_markers)
+        self.image_plot.scene().sigMouseClicked.connect(self._add_reference_point)
+
+        # GUI frame time (debug overlay)
+        self.frame_time = display.FrameTimeOverlay(self.image_plot.vb)
+
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self._update_image)
         self.timer.setInterval(50)
@@ -104,19 +166,66 @@ class FrameView(pg.GraphicsLayoutWidget):
 
     def set_attribute(self, frame_name):
         self._attribute = vxattribute.get_attribute(frame_name)
+        self._last_index = None
+        self._flip_y = frame_name == 'particle_occupancy'
+
+    def set_frame_time_visible(self, visible):
+        self.frame_time.set_visible(visible)
+
+    def set_point_mode(self, active):
+        self._calibrate = active
+
+    def reference_points(self):
+        return list(self._points)
+
+    def clear_points(self):
+        self._points = []
+        self.point_markers.clear()
+
+    def _add_reference_point(self, ev):
+        if not self._calibrate or ev.button() != QtCore.Qt.MouseButton.LeftButton:
+            return
+
+        pos = self.image_plot.vb.mapSceneToView(ev.scenePos())
+        text, ok = QtWidgets.QInputDialog.getText(self, 'Reference point',
+                                                  f'Arena position of pixel ({pos.x():.0f}, {pos.y():.0f}) '
+                                                  f'as x, y [mm]')
+        if not ok:
+            return
+        try:
+            world = tuple(float(v) for v in text.split(','))
+        except ValueError:
+            return
+        if len(world) != 2:
+            return
+
+        self._points.append(((pos.x(), pos.y()), world))
+        self.point_markers.addPoints([pos.x()], [pos.y()])
 
     def _update_image(self):
+        self.frame_time.start()
         if self._attribute is None:
             return
 
+        # Skip polls without a new frame
+        index = self._attribute.index
+        if index == self._last_index:
+            return
+
         # Read last frame
         idx, time, frame = self._attribute.read()
 
         if idx[0] is None:
             return
+        self._last_index = index
+        frame = frame[0]
+        if self._flip_y:
+            frame = frame[:, ::-1]
 
-        # Set frame data on image plot
-        self.image_item.setImage(frame[0])
+        # Set frame data on image plot, downsampled to its size on screen but in full resolution pixel coordinates
+        self.image_item.setImage(display.downsample(frame, display.screen_size(self.image_plot.vb, frame.shape)))
+        self.image_item.setRect(QtCore.QRectF(0, 0, frame.shape[0], frame.shape[1]))
+        self.frame_time.stop()
 
 
 class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
@@ -133,6 +242,7 @@ class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
         # Frame
         self.frame_view = FrameView(self)
         self.frame_view.rect_roi.sigRegionChangeFinished.connect(self._update_roi_parameters)
+        self.frame_view.polygon_roi.sigRegionChangeFinished.connect(self._update_polygon_parameters)
         self.plots.layout().addWidget(self.frame_view)
 
         # ROIs
@@ -147,16 +257,73 @@ class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
         self.layout().addWidget(self.console)
         # Display choice
         self.display_choice = widgets.ComboBox(self)
-        self.display_choice.connect_callback(self.frame_view.set_attribute)
+        self.display_choice.connect_callback(self.set_display_attribute)
         self.display_choice.add_items(['freeswim_tracked_zf_frame',
                                        'freeswim_tracked_zf_filtered',
-                                       'freeswim_tracked_zf_binary'])
+                                       'freeswim_tracked_zf_binary',
+                                       'particle_occupancy'])
         self.console.layout().addWidget(self.display_choice)
         # Calibration mode
         self.calibration = widgets.ComboBox(self)
         self.calibration.connect_callback(self.set_calibration_mode)
         self.calibration.add_items(['Open', 'Locked'])
         self.console.layout().addWidget(self.calibration)
+        # Arena mode
+        self.arena_mode = widgets.ComboBox(self)
+        self.arena_mode.connect_callback(self.set_arena_mode)
+        self.arena_mode.add_items(['full', 'rectangle', 'polygon'])
+        self.console.layout().addWidget(self.arena_mode)
+        # Downsample factor for foreground detection
+        self.downsample_factor = widgets.ComboBox(self)
+        self.downsample_factor.connect_callback(self.set_downsample_factor)
+        self.downsample_factor.add_items(['1', '2', '4'])
+        self.console.layout().addWidget(self.downsample_factor)
+        # Background model
+        self.background_engine = widgets.ComboBox(self)
+        self.background_engine.connect_callback(self.set_background_engine)
+        self.background_engine.add_items(list(background.engines))
+        self.console.layout().addWidget(self.background_engine)
+        # Threads
+        self.thread_num = widgets.IntSliderWidget(self.console, label='Threads',
+                                                  default=FreeswimTrackerRoutine.thread_num,
+                                                  limits=(1, 16))
+        self.thread_num.connect_callback(self.set_thread_num)
+        self.console.layout().addWidget(self.thread_num)
+        self.save_background = QtWidgets.QPushButton('Save background')
+        self.save_background.clicked.connect(self.save_background_state)
+        self.console.layout().addWidget(self.save_background)
+        # Camera calibration from clicked reference points or a checkerboard
+        self.pick_points = QtWidgets.QPushButton('Pick reference points')
+        self.pick_points.setCheckable(True)
+        self.pick_points.toggled.connect(self.frame_view.set_point_mode)
+        self.console.layout().addWidget(self.pick_points)
+        self.fit_points = QtWidgets.QPushButton('Calibrate from points')
+        self.fit_points.clicked.connect(self.calibrate_from_points)
+        self.console.layout().addWidget(self.fit_points)
+        self.fit_checkerboard = QtWidgets.QPushButton('Calibrate from checkerboard')
+        self.fit_checkerboard.clicked.connect(self.calibrate_from_checkerboard)
+        self.console.layout().addWidget(self.fit_checkerboard)
+        # Backpressure mode
+        self.backpressure_mode = widgets.ComboBox(self)
+        self.backpressure_mode.connect_callback(self.set_backpressure_mode)
+        self.backpressure_mode.add_items(['off', 'drop', 'predict'])
+        self.console.layout().addWidget(self.backpressure_mode)
+        # Ragged particle recording
+        self.particle_recording = QtWidgets.QCheckBox('Record particles')
+        camera_config = config.CONF_CAMERA_DEVICES.get(FreeswimTrackerRoutine.camera_device_id, {})
+        self.particle_recording.setChecked(camera_config.get('particle_recording',
+                                                             FreeswimTrackerRoutine.particle_recording_enabled))
+        self.particle_recording.stateChanged.connect(self.set_particle_recording_enabled)
+        self.console.layout().addWidget(self.particle_recording)
+        # Occupancy and kinematics statistics
+        self.reset_kinematics = QtWidgets.QPushButton('Reset statistics')
+        self.reset_kinematics.clicked.connect(self.reset_kinematics_statistics)
+        self.console.layout().addWidget(self.reset_kinematics)
+        # Stage timing
+        self.timing_enabled = QtWidgets.QCheckBox('Stage timing')
+        self.timing_enabled.setChecked(FreeswimTrackerRoutine.timing_enabled)
+        self.timing_enabled.stateChanged.connect(self.set_timing_enabled)
+        self.console.layout().addWidget(self.timing_enabled)
         # Threshold
         self.binary_threshold = widgets.IntSliderWidget(self.console, label='Threshold [au]',
                                                         default=FreeswimTrackerRoutine.binary_thresh_val,
@@ -175,6 +342,20 @@ class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
                                                 limits=(1, 255))
         self.min_area.connect_callback(self.set_min_area)
         self.console.layout().addWidget(self.min_area)
+        # Automatic search of threshold, filter size and min. area for a known number of fish
+        self.target_count = widgets.IntSliderWidget(self.console, label='Target fish count',
+                                                    default=5, limits=(1, FreeswimTrackerRoutine.max_particle_number))
+        self.console.layout().addWidget(self.target_count)
+        self.autotune = QtWidgets.QPushButton('Auto-tune')
+        self.autotune.clicked.connect(self.start_autotune)
+        self.console.layout().addWidget(self.autotune)
+        # Auto-tune results are shown on the sliders above
+        self._autotune_attribute = None
+        self._last_autotune_index = None
+        self.autotune_timer = QtCore.QTimer()
+        self.autotune_timer.timeout.connect(self._update_autotuned_parameters)
+        self.autotune_timer.setInterval(200)
+        self.autotune_timer.start()
         # X dim
         self.x_dimension_length = widgets.IntSliderWidget(self.console, label='X dimension [mm]',
                                                           default=FreeswimTrackerRoutine.dimension_size[0],
@@ -192,6 +373,10 @@ class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
                                                             QtWidgets.QSizePolicy.Minimum,
                                                             QtWidgets.QSizePolicy.MinimumExpanding))
 
+    def set_display_attribute(self, name):
+        self.frame_view.set_attribute(name)
+        self.call_routine(FreeswimTrackerRoutine.set_display_attribute, name)
+
     def set_calibration_mode(self, mode):
         self.frame_view.rect_roi.set_calibration_mode(mode == 'Open')
 
@@ -201,6 +386,29 @@ class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
     def set_min_area(self):
         self.call_routine(FreeswimTrackerRoutine.set_min_area, self.min_area.get_value())
 
+    def start_autotune(self):
+        self.call_routine(FreeswimTrackerRoutine.start_autotune, self.target_count.get_value())
+
+    def _update_autotuned_parameters(self):
+        if self._autotune_attribute is None:
+            self._autotune_attribute = vxattribute.get_attribute('freeswim_tracker_autotune_result')
+            if self._autotune_attribute is None:
+                return
+
+        index = self._autotune_attribute.index
+        if index == self._last_autotune_index:
+            return
+        idx, _, values = self._autotune_attribute.read()
+        if idx[0] is None:
+            return
+        self._last_autotune_index = index
+
+        # Slider callbacks send the tuned values back to the routine, which already uses them
+        threshold, filter_size, min_area = (int(v) for v in values[0])
+        self.binary_threshold.set_value(threshold)
+        self.filter_size.set_value(filter_size)
+        self.min_area.set_value(min_area)
+
     def set_binary_threshold(self, value):
         vxipc.rpc(PROCESS_CAMERA, FreeswimTrackerRoutine.set_binary_threshold, value)
         # self.call_routine(FreeswimTrackerRoutine.set_binary_threshold, self.binary_threshold.get_value())
@@ -211,6 +419,56 @@ class FreeswimTrackerWidget(vxgui.CameraAddonWidget):
     def set_y_dimension_size(self):
         self.call_routine(FreeswimTrackerRoutine.set_y_dimension_size, self.y_dimension_length.get_value())
 
+    def set_arena_mode(self, mode):
+        self.frame_view.polygon_roi.setVisible(mode == 'polygon')
+        if mode == 'polygon':
+            self._update_polygon_parameters()
+        self.call_routine(FreeswimTrackerRoutine.set_arena_mode, mode)
+
+    def set_downsample_factor(self, factor):
+        self.call_routine(FreeswimTrackerRoutine.set_downsample_factor, int(factor))
+
+    def set_background_engine(self, name):
+        self.call_routine(FreeswimTrackerRoutine.set_background_engine, name)
+
+    def set_thread_num(self, value):
+        self.call_routine(FreeswimTrackerRoutine.set_thread_num, value)
+
+    def save_background_state(self):
+        self.call_routine(FreeswimTrackerRoutine.save_background_state)
+
+    def calibrate_from_points(self):
+        points = self.frame_view.reference_points()
+        if len(points) < 4:
+            return
+        self.call_routine(FreeswimTrackerRoutine.calibrate_from_points,
+                          [pixel for pixel, _ in points], [world for _, world in points])
+        self.pick_points.setChecked(False)
+        self.frame_view.clear_points()
+
+    def calibrate_from_checkerboard(self):
+        self.call_routine(FreeswimTrackerRoutine.calibrate_from_checkerboard)
+
+    def set_backpressure_mode(self, mode):
+        self.call_routine(FreeswimTrackerRoutine.set_backpressure_mode, mode)
+
+    def set_timing_enabled(self):
+        self.call_routine(FreeswimTrackerRoutine.set_timing_enabled, self.timing_enabled.isChecked())
+        # Show GUI frame time of the views as well
+        self.frame_view.set_frame_time_visible(self.timing_enabled.isChecked())
+        self.roi_view.set_frame_time_visible(self.timing_enabled.isChecked())
+
+    def set_particle_recording_enabled(self):
+        self.call_routine(FreeswimTrackerRoutine.set_particle_recording_enabled, self.particle_recording.isChecked())
+
+    def reset_kinematics_statistics(self):
+        self.call_routine(FreeswimTrackerRoutine.reset_kinematics)
+
+    def _update_polygon_parameters(self):
+        pos = self.frame_view.polygon_roi.pos()
+        points = [(p.x() + pos.x(), p.y() + pos.y()) for _, p in self.frame_view.polygon_roi.getLocalHandlePositions()]
+        self.call_routine(FreeswimTrackerRoutine.set_arena_polygon, points)
+
     def _update_roi_parameters(self):
         pos = self.frame_view.rect_roi.pos()
         self.call_routine(FreeswimTrackerRoutine.set_calibration_rect_pos, (pos.x(), pos.y()))
@@ -230,6 +488,42 @@ class FreeswimTrackerRoutine(vxroutine.CameraRoutine):
     calibration_rect_pos = np.array([0, 0])
     calibration_rect_size = np.array([1, 1])
     max_particle_number = 10
+    # Arena ('full', 'rectangle' or 'polygon')
+    arena_mode = 'full'
+    arena_polygon = []
+    # Foreground detection
+    downsample_factor = 1
+    background_engine = 'mog2'
+    thread_num = 1
+    background_state_path = 'background_models'
+    # Tracking
+    track_max_distance = 50.  # px
+    track_max_missed = 10  # frames
+    # Debug frames (only the one selected in the GUI, every display_interval frames)
+    display_attribute = None
+    display_interval = 6
+    render_all_display_frames = False
+    # Stage timing (see plugins.common.timing)
+    timing_enabled = False
+    timing_window = 1150
+    # Backpressure ('off', 'drop' or 'predict', see freeswim.backpressure)
+    backpressure_mode = 'off'
+    max_processing_lag = 20.  # ms
+    max_prediction_interval = 4
+    # Camera calibration (see freeswim.calibration)
+    camera_calibration = None
+    checkerboard_size = (9, 6)
+    checkerboard_square_size = 10.  # mm
+    # Particle recording (see freeswim.ragged)
+    particle_recording_enabled = True
+    record_padded_particles = False
+    # Kinematics statistics (see freeswim.kinematics)
+    occupancy_bin_size = 2.  # mm
+    max_speed = 100.  # mm/s
+    kinematics_interval = 115  # frames
+    # Auto-tune (see freeswim.autotune)
+    autotune_frame_num = 32
+    autotune_sample_interval = 10
 
     def setup(self):
 
@@ -237,6 +531,25 @@ class FreeswimTrackerRoutine(vxroutine.CameraRoutine):
         camera_config = config.CONF_CAMERA_DEVICES.get(self.camera_device_id)
         self.res_x = camera_config['width']
         self.res_y = camera_config['height']
+        self.camera_serial = camera_config.get('serial', 0)
+        # Memory layout of camera buffers ('height_width' or 'width_height').
+        # All analysis happens on (height, width) frames, output attributes use (width, height)
+        self.frame_layout = camera_config.get('frame_layout', 'height_width')
+        self.background_engine = camera_config.get('background_engine', self.background_engine)
+        self.particle_recording_enabled = camera_config.get('particle_recording', self.particle_recording_enabled)
+        self.record_padded_particles = camera_config.get('record_padded_particles', self.record_padded_particles)
+        self.lag_monitor = backpressure.LagMonitor(camera_config.get('framerate', 115))
+
+        # Frame analysis (reads processing parameters from this routine on every frame)
+        self.tracker = tracker.FreeswimTracker((self.res_y, self.res_x), self, self.downsample_factor,
+                                               self.background_engine, self.thread_num,
+                                               self.track_max_distance, self.track_max_missed)
+        self.detector = self.tracker.detector
+
+        # Full sized buffers for arena sized debug frames and display frame, reused in place
+        self._filtered_buffer = np.zeros((self.res_y, self.res_x), dtype=np.uint8)
+        self._binary_buffer = np.zeros((self.res_y, self.res_x), dtype=np.uint8)
+        self._display_buffer = np.zeros((self.res_y, self.res_x, 3), dtype=np.uint8)
 
         self.freeswim_tracked_zf_frame = vxattribute.ArrayAttribute('freeswim_tracked_zf_frame',
                                                                     (self.res_x, self.res_y, 3),
@@ -258,13 +571,74 @@ class FreeswimTrackerRoutine(vxroutine.CameraRoutine):
         self.particle_count_filtered = vxattribute.ArrayAttribute('particle_count_filtered',
                                                                   (1,),
                                                                   dtype=vxattribute.ArrayType.uint64)
+        # Number of valid rows in particle_rois and particle_mapped_position
+        self.particle_count_selected = vxattribute.ArrayAttribute('particle_count_selected',
+                                                                  (1,),
+                                                                  dtype=vxattribute.ArrayType.uint64)
         self.particle_mapped_position = vxattribute.ArrayAttribute('particle_mapped_position',
                                                                    (self.max_particle_number, 2,),
                                                                    dtype=vxattribute.ArrayType.float64)
+        self.particle_tracks = vxattribute.ArrayAttribute('particle_tracks',
+                                                          (self.max_particle_number, 2,),
+                                                          dtype=vxattribute.ArrayType.float64)
+        self.particle_track_ids = vxattribute.ArrayAttribute('particle_track_ids',
+                                                             (self.max_particle_number,),
+                                                             dtype=vxattribute.ArrayType.uint64)
+
+        # Occupancy, speed and heading statistics since start (or last reset), written every kinematics_interval frames
+        self.kinematics = kinematics.KinematicsAccumulator(self.dimension_size, self.occupancy_bin_size,
+                                                           self.max_speed, slot_num=self.max_particle_number)
+        self.particle_occupancy = vxattribute.ArrayAttribute('particle_occupancy', self.kinematics.occupancy.shape,
+                                                             dtype=vxattribute.ArrayType.uint32)
+        self.particle_vertical_histogram = vxattribute.ArrayAttribute('particle_vertical_histogram',
+                                                                      (self.kinematics.occupancy.shape[1],),
+                                                                      dtype=vxattribute.ArrayType.uint64)
+        self.particle_speed_histogram = vxattribute.ArrayAttribute('particle_speed_histogram',
+                                                                   self.kinematics.speed_histogram.shape,
+                                                                   dtype=vxattribute.ArrayType.uint32)
+        self.particle_heading_histogram = vxattribute.ArrayAttribute('particle_heading_histogram',
+                                                                     self.kinematics.heading_histogram.shape,
+                                                                     dtype=vxattribute.ArrayType.uint32)
+        self.particle_speed_mean = vxattribute.ArrayAttribute('particle_speed_mean', (1,),
+                                                              dtype=vxattribute.ArrayType.float64)
+        self.particle_speed_std = vxattribute.ArrayAttribute('particle_speed_std', (1,),
+                                                             dtype=vxattribute.ArrayType.float64)
+
+        # Frames which were not fully analysed and estimated lag [ms] behind the camera
+        self.tracker_dropped_frames = vxattribute.ArrayAttribute('tracker_dropped_frames', (1,),
+                                                                 dtype=vxattribute.ArrayType.uint64)
+        self.tracker_processing_lag = vxattribute.ArrayAttribute('tracker_processing_lag', (1,),
+                                                                 dtype=vxattribute.ArrayType.float32)
+
+        # Threshold, filter size and min. area of the last auto-tune result
+        self.freeswim_tracker_autotune_result = vxattribute.ArrayAttribute('freeswim_tracker_autotune_result', (3,),
+                                                                           dtype=vxattribute.ArrayType.uint32)
+
+        # Stage timing (analysis stages of the tracker, display frame rendering and attribute writes)
+        self.timer = timing.StageTimer((*self.tracker.stage_names, 'display', 'write'), self.timing_window)
+        self.timing_attributes = [vxattribute.ArrayAttribute(f'freeswim_tracker_timing_{name}', (1,),
+                                                             dtype=vxattribute.ArrayType.float32)
+                                  for name in self.timer.stage_names]
 
     def initialize(self):
-        # Create mixture of gaussian BG subtractor
-        self.mog = cv2.createBackgroundSubtractorMOG2(400, detectShadows=False)
+        self._frame_counter = 0
+        self._dropped_frame_num = 0
+        self._checkerboard_requested = False
+        self.autotuner = autotune.AutoTuner(self.autotune_frame_num, self.autotune_sample_interval)
+        self._particle_writer = None
+
+        self.camera_calibration = calibration.load(calibration.filepath(config.CONF_CALIBRATION_PATH))
+        if self.camera_calibration is not None:
+            log.info(f'Restored camera calibration from {calibration.filepath(config.CONF_CALIBRATION_PATH)}')
+        self._frames_since_analysis = 0
+        self._outside_warned = False
+
+        # Set processing region and create background model for it
+        self._update_arena()
+
+        # Keep learned background for next start
+        atexit.register(self.save_background_state)
+        atexit.register(self._stop_particle_recording)
 
         # Add expposed methods
         self.exposed.append(FreeswimTrackerRoutine.set_calibration_rect_pos)
@@ -274,26 +648,242 @@ class FreeswimTrackerRoutine(vxroutine.CameraRoutine):
         self.exposed.append(FreeswimTrackerRoutine.set_min_area)
         self.exposed.append(FreeswimTrackerRoutine.set_binary_threshold)
         self.exposed.append(FreeswimTrackerRoutine.set_filter_size)
+        self.exposed.append(FreeswimTrackerRoutine.set_arena_mode)
+        self.exposed.append(FreeswimTrackerRoutine.set_arena_polygon)
+        self.exposed.append(FreeswimTrackerRoutine.set_downsample_factor)
+        self.exposed.append(FreeswimTrackerRoutine.set_background_engine)
+        self.exposed.append(FreeswimTrackerRoutine.set_thread_num)
+        self.exposed.append(FreeswimTrackerRoutine.save_background_state)
+        self.exposed.append(FreeswimTrackerRoutine.set_display_attribute)
+        self.exposed.append(FreeswimTrackerRoutine.set_display_interval)
+        self.exposed.append(FreeswimTrackerRoutine.set_render_all_display_frames)
+        self.exposed.append(FreeswimTrackerRoutine.set_timing_enabled)
+        self.exposed.append(FreeswimTrackerRoutine.set_backpressure_mode)
+        self.exposed.append(FreeswimTrackerRoutine.calibrate_from_points)
+        self.exposed.append(FreeswimTrackerRoutine.calibrate_from_checkerboard)
+        self.exposed.append(FreeswimTrackerRoutine.set_particle_recording_enabled)
+        self.exposed.append(FreeswimTrackerRoutine.reset_kinematics)
+        self.exposed.append(FreeswimTrackerRoutine.start_autotune)
 
         register_with_plotter('particle_count_total', axis='particle_count')
         register_with_plotter('particle_count_filtered', axis='particle_count')
 
-        write_to_file(self, 'particle_rois')
+        if self.record_padded_particles:
+            write_to_file(self, 'particle_rois')
+            write_to_file(self, 'particle_mapped_position')
         write_to_file(self, 'particle_count_total')
         write_to_file(self, 'particle_count_filtered')
-        write_to_file(self, 'particle_mapped_position')
+        write_to_file(self, 'particle_count_selected')
+        write_to_file(self, 'particle_tracks')
+        write_to_file(self, 'particle_track_ids')
+        write_to_file(self, 'tracker_dropped_frames')
+        write_to_file(self, 'tracker_processing_lag')
+        register_with_plotter('tracker_processing_lag', axis='tracker_processing_lag')
+
+        for name in ['particle_occupancy', 'particle_vertical_histogram', 'particle_speed_histogram',
+                     'particle_heading_histogram', 'particle_speed_mean', 'particle_speed_std']:
+            write_to_file(self, name)
+        register_with_plotter('particle_speed_mean', axis='particle_speed')
+
+        for attribute in self.timing_attributes:
+            register_with_plotter(attribute.name, axis='freeswim_tracker_timing')
+            attribute.add_to_file()
+
+    def _update_arena(self):
+        if self.arena_mode == 'rectangle':
+            self.detector.arena.set_rectangle(self.calibration_rect_pos, self.calibration_rect_size)
+        elif self.arena_mode == 'polygon':
+            self.detector.arena.set_polygon(self.arena_polygon)
+        else:
+            self.detector.arena.set_full_frame()
+
+        # Clear stale debug frame content outside of new region
+        self._filtered_buffer[:] = 0
+        self._binary_buffer[:] = 0
+
+        # Background model is only valid for the region it was learned on
+        self.detector.reset_background()
+        self._load_background_state()
+
+    def _background_state_file(self) -> str:
+        # Saved states are specific to camera, arena rectangle, resolution and background engine
+        rows, cols = self.detector.arena.slices
+        filename = f'{self.camera_serial}_x{cols.start}_y{rows.start}_w{cols.stop - cols.start}' \
+                   f'_h{rows.stop - rows.start}_f{self.downsample_factor}_{self.background_engine}'
+        return os.path.join(self.background_state_path, filename)
+
+    def _load_background_state(self):
+        filepath = self._background_state_file()
+        if self.detector.load_background(filepath):
+            log.info(f'Restored background model from {filepath}')
+
+    def save_background_state(self):
+        filepath = self._background_state_file()
+        if self.detector.save_background(filepath):
+            log.info(f'Saved background model to {filepath}')
 
     def set_calibration_rect_pos(self, value):
         self.calibration_rect_pos = np.array(value)
+        if self.arena_mode == 'rectangle':
+            self._update_arena()
 
     def set_calibration_rect_size(self, value):
         self.calibration_rect_size = np.array(value)
+        if self.arena_mode == 'rectangle':
+            self._update_arena()
+
+    def set_arena_mode(self, value):
+        self.arena_mode = value
+        self._update_arena()
+
+    def set_arena_polygon(self, value):
+        self.arena_polygon = list(value)
+        if self.arena_mode == 'polygon':
+            self._update_arena()
+
+    def set_downsample_factor(self, value):
+        self.downsample_factor = max(int(value), 1)
+        self.detector.set_downsample_factor(self.downsample_factor)
+        self._load_background_state()
+
+    def set_background_engine(self, value):
+        self.background_engine = value
+        self.detector.set_background_engine(self.background_engine)
+        self._load_background_state()
+
+    def set_thread_num(self, value):
+        self.thread_num = max(int(value), 1)
+        self.detector.set_thread_num(self.thread_num)
+        self._load_background_state()
+
+    def set_display_attribute(self, value):
+        self.display_attribute = value
+
+    def set_display_interval(self, value):
+        self.display_interval = max(int(value), 1)
+
+    def set_render_all_display_frames(self, value):
+        self.render_all_display_frames = bool(value)
+
+    def set_timing_enabled(self, value):
+        self.timing_enabled = bool(value)
+
+    def _set_camera_calibration(self, camera_calibration: calibration.CameraCalibration):
+        self.camera_calibration = camera_calibration
+        calibration.save(camera_calibration, calibration.filepath(config.CONF_CALIBRATION_PATH))
+        log.info(f'Saved camera calibration to {calibration.filepath(config.CONF_CALIBRATION_PATH)}')
+
+    def calibrate_from_points(self, pixel_points, world_points):
+        try:
+            camera_calibration = calibration.fit_points(pixel_points, world_points)
+        except ValueError as exc:
+            log.warning(f'Camera calibration failed: {exc}')
+            return
+
+        log.info(f'Fitted camera calibration to {len(pixel_points)} reference points, '
+                 f'mean error {camera_calibration.error(pixel_points, world_points):.2f} mm')
+        self._set_camera_calibration(camera_calibration)
+
+    def calibrate_from_checkerboard(self):
+        # Checkerboard is detected on the next frame
+        self._checkerboard_requested = True
+
+    def _detect_checkerboard(self, frame: np.ndarray):
+        self._checkerboard_requested = False
+        camera_calibration = calibration.fit_checkerboard(frame, self.checkerboard_size, self.checkerboard_square_size)
+        if camera_calibration is None:
+            log.warning(f'No {self.checkerboard_size[0]}x{self.checkerboard_size[1]} checkerboard found in frame')
+            return
+
+        log.info('Fitted camera calibration to checkerboard')
+        self._set_camera_calibration(camera_calibration)
+
+    def _sync_particle_recording(self):
+        # Ragged particle file follows start and stop of vxPy recordings
+        recording = self.particle_recording_enabled and bool(vxipc.CONTROL[CTRL_REC_ACTIVE])
+        if recording and self._particle_writer is None:
+            self._start_particle_recording()
+        elif not recording and self._particle_writer is not None:
+            self._stop_particle_recording()
+
+    def _start_particle_recording(self):
+        filepath = os.path.join(vxipc.get_recording_path(), 'freeswim_particles.hdf5')
+        # ROI crops are compressed in the writing process, off the camera process
+        self._particle_writer = ragged.BackgroundRaggedWriter(filepath,
+                                                              {'particle_rois': (self.rect_size, np.uint8),
+                                                               'particle_mapped_position': ((2,), np.float64),
+                                                               'particle_pixel_position': ((2,), np.int64),
+                                                               'particle_track_ids': ((), np.uint64)},
+                                                              compressed_fields=['particle_rois'],
+                                                              id_field='particle_track_ids')
+        log.info(f'Record particles to {filepath}')
+
+    def _stop_particle_recording(self):
+        if self._particle_writer is None:
+            return
+        self._particle_writer.close()
+        self._particle_writer = None
+
+    def set_particle_recording_enabled(self, value):
+        self.particle_recording_enabled = bool(value)
+
+    def start_autotune(self, target_count):
+        if self.autotuner.busy:
+            log.warning('Auto-tune is already running')
+            return
+        log.info(f'Start auto-tune for {target_count} fish')
+        self.autotuner.start(int(target_count), self.detector.arena.mask)
+
+    def _apply_autotune_result(self):
+        result = self.autotuner.result
+        self.autotuner.result = None
+        log.info(f'Auto-tune result: threshold {result.binary_thresh_val}, filter size {result.filter_size}, '
+                 f'min. area {result.min_area} '
+                 f'(count error {result.count_error:.2f}, count std {result.count_std:.2f})')
+        self.set_binary_threshold(result.binary_thresh_val)
+        self.set_filter_size(result.filter_size)
+        self.set_min_area(result.min_area)
+        # The widget moves its sliders to the new values
+        self.freeswim_tracker_autotune_result.write([self.binary_thresh_val, self.filter_size, self.min_area])
+
+    def reset_kinematics(self):
+        self.kinematics.reset()
+        self._outside_warned = False
+
+    def _write_kinematics(self):
+        # Warn once per reset
+        if self.kinematics.outside_count > 0 and not self._outside_warned:
+            log.warning(f'Track positions outside of the occupancy grid (0 to {self.kinematics.extent} mm) '
+                        f'are not counted')
+            self._outside_warned = True
+        self.particle_occupancy.write(self.kinematics.occupancy)
+        self.particle_vertical_histogram.write(self.kinematics.vertical_histogram)
+        self.particle_speed_histogram.write(self.kinematics.speed_histogram)
+        self.particle_heading_histogram.write(self.kinematics.heading_histogram)
+        self.particle_speed_mean.write(self.kinematics.speed_mean)
+        self.particle_speed_std.write(self.kinematics.speed_std)
+
+    def set_backpressure_mode(self, value):
+        self.backpressure_mode = value
+        self._frames_since_analysis = 0
+
+    def _display_requested(self, name: str) -> bool:
+        if self.render_all_display_frames:
+            return True
+        return name == self.display_attribute and self._frame_counter % self.display_interval == 0
 
     def set_x_dimension_size(self, value):
         self.dimension_size[0] = value
+        self._warn_occupancy_extent()
 
     def set_y_dimension_size(self, value):
         self.dimension_size[1] = value
+        self._warn_occupancy_extent()
+
+    def _warn_occupancy_extent(self):
+        if np.any(self.dimension_size > self.kinematics.extent):
+            log.warning(f'Occupancy grid keeps its startup extent of {self.kinematics.extent} mm, '
+                        f'positions beyond it are not counted')
 
     def set_min_area(self, value):
         self.min_area = value
@@ -304,106 +894,120 @@ class FreeswimTrackerRoutine(vxroutine.CameraRoutine):
     def set_filter_size(self, value):
         self.filter_size = value // 2 * 2 + 1  # always make sure that filter size is odd integer
 
-    def _apply_dimensions(self, point: np.ndarray) -> np.ndarray:
-        p = point.copy()
-        p = p - self.calibration_rect_pos
-        p = p / self.calibration_rect_size
-        p = p * self.dimension_size
-        p[1] = self.dimension_size[1] - p[1]
-
-        return p
-
     def main(self, **frames):
         frame = frames.get(self.camera_device_id)
 
         if frame is None:
             return
 
-        if frame.ndim > 2:
-            frame = frame[:, :, 0].T
-        frame = frame.T
-
-        display_frame = np.repeat(frame[:, :, np.newaxis], 3, axis=-1)
-        display_frame = cv2.rotate(cv2.flip(display_frame, 0), cv2.ROTATE_90_CLOCKWISE)
-
-        # Calculate background distribution and foreground mask
-        foreground_mask = self.mog.apply(frame)
-
-        # Smooth mask
-        filtered_frame = cv2.GaussianBlur(foreground_mask, (self.filter_size,) * 2, cv2.BORDER_DEFAULT)
-        self.freeswim_tracked_zf_filtered.write(filtered_frame)
-
-        # Apply threshold
-        _, thresh_frame = cv2.threshold(filtered_frame, self.binary_thresh_val, 255, cv2.THRESH_BINARY)
-        self.freeswim_tracked_zf_binary.write(thresh_frame)
-
-        # Detect and filter contours
-        contours, hierarchy = cv2.findContours(thresh_frame, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        xdiff, ydiff = self.rect_size[0] // 2, self.rect_size[1] // 2
-        particle_rectangles = []
-        particle_areas = []
-        particle_positions = []
-        # print('---')
-        # print('Pos', self.calibration_rect_pos)
-        # print('Size', self.calibration_rect_size)
-        self.particle_count_total.write(len(contours))
-        if len(contours) > 0:
-            i = 0
-            for cnt in contours:
-
-                M = cv2.moments(cnt)
-                area = cv2.contourArea(cnt)
-                if area < self.min_area:
-                    continue
-
-                # Calculate centroid
-                centroid = np.array([int(M['m10'] / M['m00']), int(M['m01'] / M['m00'])])
-                c_rev = np.array([centroid[1], centroid[0]])
-                mapped_position = self._apply_dimensions(c_rev)
-
-                # Crop rectangular ROI
-                rect = frame[centroid[1] - ydiff:centroid[1] + ydiff, centroid[0] - xdiff:centroid[0] + xdiff]
-
-                # Mark ROIs on display frame
-                cv2.rectangle(display_frame,
-                              [c_rev[0] - xdiff, c_rev[1] - ydiff], [c_rev[0] + xdiff, c_rev[1] + ydiff],
-                              (255, 0, 0), 2)
+        lag = self.lag_monitor.frame_started()
+        self.tracker_processing_lag.write(lag)
+
+        # Skip stale frames until the camera has been caught up with
+        if self.backpressure_mode == 'drop' and lag > self.max_processing_lag:
+            self._dropped_frame_num += 1
+            self.tracker_dropped_frames.write(self._dropped_frame_num)
+            return
 
+        # Only analyse every k-th frame and predict positions in between
+        analyse = True
+        if self.backpressure_mode == 'predict':
+            interval = self.lag_monitor.analysis_interval(self.max_prediction_interval)
+            if lag <= self.max_processing_lag:
+                interval = 1
+            analyse = self._frames_since_analysis + 1 >= interval
+            self._frames_since_analysis = 0 if analyse else self._frames_since_analysis + 1
+            if not analyse:
+                self._dropped_frame_num += 1
+        self.tracker_dropped_frames.write(self._dropped_frame_num)
+
+        # Get (height, width) view on camera buffer
+        if frame.ndim > 2:
+            frame = frame[:, :, 0]
+        if self.frame_layout == 'width_height':
+            frame = frame.T
+
+        if self._checkerboard_requested:
+            self._detect_checkerboard(frame)
+
+        # Sample arena for auto-tune (no-op unless sampling) and apply finished search
+        self.autotuner.add_frame(self.detector.arena.crop(frame))
+        if self.autotuner.result is not None:
+            self._apply_autotune_result()
+
+        timer = self.timer if self.timing_enabled else None
+        display_index = len(self.tracker.stage_names)
+        if timer is not None:
+            timer.start()
+
+        # Only render annotated display frame if it is currently requested
+        self._frame_counter += 1
+        display_frame = None
+        if self._display_requested('freeswim_tracked_zf_frame'):
+            display_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB, dst=self._display_buffer)
+        if timer is not None:
+            timer.lap(display_index)
+
+        # Analyse frame
+        if analyse:
+            particle_num = self.tracker.process(frame)
+            self.lag_monitor.add_analysis_duration(self.tracker.stage_durations.sum())
+        else:
+            particle_num = self.tracker.predict(frame)
+        if timer is not None:
+            timer.record(self.tracker.stage_durations)
+
+        if analyse and self._display_requested('freeswim_tracked_zf_filtered'):
+            self.freeswim_tracked_zf_filtered.write(self.detector.paste(self.tracker.filtered_frame,
+                                                                        self._filtered_buffer).T)
+        if analyse and self._display_requested('freeswim_tracked_zf_binary'):
+            self.freeswim_tracked_zf_binary.write(self.detector.paste(self.tracker.binary_frame,
+                                                                      self._binary_buffer).T)
+
+        self.particle_count_total.write(self.tracker.count_total)
+        self.particle_count_filtered.write(self.tracker.count_filtered)
+        self.particle_count_selected.write(min(particle_num, self.max_particle_number))
+
+        # Record all particles without padding
+        self._sync_particle_recording()
+        if self._particle_writer is not None:
+            self._particle_writer.append(vxipc.get_time(),
+                                         particle_rois=self.tracker.rois[:particle_num],
+                                         particle_mapped_position=self.tracker.positions[:particle_num],
+                                         particle_pixel_position=self.tracker.pixel_positions,
+                                         particle_track_ids=self.tracker.particle_track_ids)
+
+        # Write identity-stable positions
+        self.particle_tracks.write(self.tracker.tracks)
+        self.particle_track_ids.write(self.tracker.identity_tracker.ids)
+
+        # Update statistics every frame, write them at a low rate
+        self.kinematics.update(self.tracker.tracks, self.tracker.identity_tracker.ids, vxipc.get_time())
+        if self._frame_counter % self.kinematics_interval == 0:
+            self._write_kinematics()
+
+        # Write boxes and centroid positions of the largest particles every frame (unused rows are cleared),
+        # so that their entries share indices with particle_count_selected
+        self.particle_rois.write(self.tracker.padded_rois)
+        self.particle_mapped_position.write(self.tracker.padded_positions)
+
+        if particle_num > 0:
+            # Mark ROIs on display frame
+            if display_frame is not None:
+                if timer is not None:
+                    timer.lap(display_index + 1)
+                xdiff, ydiff = self.rect_size[0] // 2, self.rect_size[1] // 2
                 text_args = (cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
-                cv2.putText(display_frame,
-                            f'x: {mapped_position[0]:.1f}',
-                            (c_rev[0] + xdiff + 5, c_rev[1] - ydiff // 2), *text_args)
-                cv2.putText(display_frame,
-                            f'y: {mapped_position[1]:.1f}',
-                            (c_rev[0] + xdiff + 5, c_rev[1] - ydiff // 2 + 25), *text_args)
-
-                if rect.shape == self.rect_size:
-                    particle_rectangles.append(rect)
-                    particle_areas.append((area, i))
-                    particle_positions.append(mapped_position)
-                    i += 1
-
-        self.particle_count_filtered.write(len(particle_areas))
-
-        if len(particle_areas) > 0:
-            # Sort particles by size
-            particle_areas = sorted(particle_areas)[::-1]
-            if len(particle_areas) > 10:
-                particle_areas = particle_areas[:10]
-
-            # Write particle ROIs to attribute
-            new_rects = np.zeros(self.particle_rois.shape)
-            new_positions = -np.ones(self.particle_mapped_position.shape)
-            for k, (_, i) in enumerate(particle_areas):
-                new_rects[k] = particle_rectangles[i]
-                new_positions[k] = particle_positions[i]
-
-            # Write particle boxes
-            self.particle_rois.write(new_rects)
-
-            # Write centroid positions
-            # print(new_positions)
-            self.particle_mapped_position.write(new_positions)
-
-        display_frame = cv2.flip(cv2.rotate(display_frame, cv2.ROTATE_90_COUNTERCLOCKWISE), 0)
-        self.freeswim_tracked_zf_frame.write(display_frame)
+                for (x, y), (x_mm, y_mm) in zip(self.tracker.pixel_positions, self.tracker.positions[:particle_num]):
+                    cv2.rectangle(display_frame, [x - xdiff, y - ydiff], [x + xdiff, y + ydiff], (255, 0, 0), 2)
+                    cv2.putText(display_frame, f'x: {x_mm:.1f}', (x + xdiff + 5, y - ydiff // 2), *text_args)
+                    cv2.putText(display_frame, f'y: {y_mm:.1f}', (x + xdiff + 5, y - ydiff // 2 + 25), *text_args)
+                if timer is not None:
+                    timer.lap(display_index)
+
+        # Orientation is only applied on write, as a transposed view
+        if display_frame is not None:
+            self.freeswim_tracked_zf_frame.write(display_frame.transpose(1, 0, 2))
+
+        if timer is not None:
+            timer.finish(self.timing_attributes, log)
@@ -0,0 +1,20 @@
+from vxpy.core.protocol import Phase, StaticPhasicProtocol
+from vxpy.visuals import pause
+
+from visuals.latency_code import LatencyCode
+
+
+class DisplayLatencyMeasurement(StaticPhasicProtocol):
+    """Show the luminance code for plugins.display_latency.DisplayLatency for one minute"""
+
+    def __init__(self, *args, **kwargs):
+        StaticPhasicProtocol.__init__(self, *args, **kwargs)
+
+        p = Phase(duration=60)
+        p.set_visual(LatencyCode)
+        self.add_phase(p)
+
+        # Blank at end of protocol
+        p = Phase(duration=2)
+        p.set_visual(pause.ClearBlack)
+        self.add_phase(p)
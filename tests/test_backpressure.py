@@ -0,0 +1,44 @@
+from plugins.freeswim import backpressure
+
+
+def run(monitor: backpressure.LagMonitor, intervals, start: float = 0.):
+    """Call frame_started at the given call intervals [ms] and return lag after every call"""
+    now = start
+    lags = [monitor.frame_started(now)]
+    for interval in intervals:
+        now += interval / 1000
+        lags.append(monitor.frame_started(now))
+    return lags
+
+
+def test_lag_bounded_for_slow_camera():
+    # Camera delivers 114 frames per second instead of the configured 115, for ten minutes
+    monitor = backpressure.LagMonitor(115)
+    lags = run(monitor, [1000 / 114] * 114 * 600)
+    assert max(lags) < 2.
+    assert lags[-1] < 0.1
+
+
+def test_lag_bounded_for_jitter():
+    # Every other call is late by 2 ms, the one after it early by 1 ms
+    monitor = backpressure.LagMonitor(100)
+    lags = run(monitor, [12., 9.] * 50000)
+    assert max(lags) < monitor.max_lag
+    assert lags[-1] < 50.
+
+
+def test_lag_recovers_after_stall():
+    monitor = backpressure.LagMonitor(100)
+    # One frame takes 100 ms, then queued frames arrive quickly, then at the camera rate
+    lags = run(monitor, [10.] * 100 + [100.] + [1.] * 5 + [10.] * 200)
+    assert lags[101] > 50.
+    assert lags[-1] < 1.
+
+
+def test_dropping_at_camera_rate_recovers():
+    # Lag above the drop threshold must shrink even if calls (of dropped frames) arrive at the camera interval
+    monitor = backpressure.LagMonitor(115)
+    run(monitor, [1000 / 115] * 10 + [200.])
+    assert monitor.lag > 20.
+    lags = run(monitor, [1000 / 115] * 200, start=monitor._last_call)
+    assert lags[-1] < 1.
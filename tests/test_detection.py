@@ -0,0 +1,33 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from plugins.freeswim import detection
+
+
+@pytest.mark.parametrize('downsample_factor', [1, 2, 4])
+def test_arena_smaller_than_downsample_factor(downsample_factor):
+    # Default calibration rectangle of the routine is a single pixel
+    detector = detection.BlobDetector((120, 160), downsample_factor)
+    detector.arena.set_rectangle((0, 0), (1, 1))
+    detector.reset_background()
+
+    frame = np.zeros((120, 160), dtype=np.uint8)
+    for _ in range(3):
+        filtered, binary, areas, centroids = detector.apply(frame, 31, 25)
+    assert binary.shape == (1, 1) and areas.shape[0] == 0
+    assert detector.paste(binary, np.zeros_like(frame)).shape == frame.shape
+
+
+@pytest.mark.parametrize('downsample_factor, thread_num', [(1, 1), (2, 1), (2, 3)])
+def test_detects_blob(downsample_factor, thread_num):
+    detector = detection.BlobDetector((120, 160), downsample_factor, thread_num=thread_num)
+    frame = np.zeros((120, 160), dtype=np.uint8)
+    for _ in range(5):
+        detector.apply(frame, 5, 25)
+
+    frame[40:50, 100:110] = 200
+    _, _, areas, centroids = detector.apply(frame, 5, 25)
+    assert areas.shape[0] == 1
+    assert np.allclose(centroids[0], (104.5, 44.5), atol=downsample_factor)
@@ -0,0 +1,41 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+
+from plugins.freeswim import ragged
+
+
+def write(group, frame_num=300, id_field=None):
+    """Frames with 0 to 4 items of ids 1 to 5, value of an item is its frame index"""
+    rng = np.random.default_rng(0)
+    writer = ragged.RaggedWriter(group, {'value': ((), np.int64), 'id': ((), np.uint64)}, block_frames=64,
+                                 id_field=id_field)
+    for i in range(frame_num):
+        ids = rng.choice(np.arange(1, 6, dtype=np.uint64), rng.integers(0, 5), replace=False)
+        writer.append(i / 100, value=np.full(ids.shape[0], i), id=ids)
+    writer.close()
+
+
+def test_read_frames(tmp_path):
+    with h5py.File(tmp_path / 'items.hdf5', 'w') as f:
+        write(f)
+        reader = ragged.RaggedReader(f)
+        assert len(reader) == 300
+        for i in [0, 63, 64, 299]:
+            values = reader.read('value', i)
+            assert values.shape[0] == reader.counts[i] and np.all(values == i)
+
+
+def test_read_ids_with_index(tmp_path):
+    with h5py.File(tmp_path / 'items.hdf5', 'w') as f:
+        write(f.create_group('scanned'))
+        write(f.create_group('indexed'), id_field='id')
+        assert 'id_index' in f['indexed'] and 'id_index' not in f['scanned']
+
+        scanned, indexed = ragged.RaggedReader(f['scanned']), ragged.RaggedReader(f['indexed'])
+        for item_id in [1, 3, 5, 7]:
+            expected_values, expected_frames = scanned.read_ids('value', 'id', item_id, 50, 250)
+            values, frames = indexed.read_ids('value', 'id', item_id, 50, 250)
+            assert np.array_equal(values, expected_values) and np.array_equal(frames, expected_frames)
+            assert np.all(values == frames) and np.all((frames >= 50) & (frames < 250))
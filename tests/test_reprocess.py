@@ -0,0 +1,39 @@
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('cv2')
+
+import freeswim_reprocess
+
+
+def write_recording(filepath, frame_num=80, shape=(120, 160)):
+    """Dark (height, width) frames with noise and a bright disc moving to the right in the right half"""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    frames = rng.integers(0, 10, (frame_num, *shape), dtype=np.uint8)
+    for i in range(frame_num):
+        disc = (yy - 60) ** 2 + (xx - (80 + i // 2)) ** 2 <= 5 ** 2
+        frames[i][disc] = 200
+    with h5py.File(filepath, 'w') as f:
+        f.create_dataset('multiple_fish_vertical_swim_frame', data=frames)
+
+
+def test_reprocess_detects_particles(tmp_path, monkeypatch):
+    input_path = tmp_path / 'Camera.hdf5'
+    output_path = tmp_path / 'results.hdf5'
+    write_recording(input_path)
+
+    monkeypatch.setattr(sys, 'argv', ['freeswim_reprocess.py', str(input_path), '--output', str(output_path),
+                                      '--workers', '1', '--chunk-size', '40', '--overlap', '20'])
+    freeswim_reprocess.main()
+
+    with h5py.File(output_path, 'r') as f:
+        assert f['particle_rois'].shape == (80, 10, 60, 60)
+        counts = f['particle_count_filtered'][:, 0]
+        tracks = f['particle_tracks'][:]
+    # Disc is found once the background model has warmed up, in both chunks and at its position in the frame
+    assert np.all(counts[30:40] == 1) and np.all(counts[70:] == 1)
+    assert np.all(tracks[70:, 0, 0] > 80 * 100)
@@ -0,0 +1,31 @@
+from vispy import gloo
+
+import vxpy.core.ipc as vxipc
+import vxpy.core.visual as vxvisual
+
+from plugins.common import latency
+
+
+class LatencyCode(vxvisual.PlainVisual):
+    """Full screen luminance code for measuring display latency with the control camera
+
+    The luminance follows plugins.common.latency.LuminanceCode at the current program time, which is what
+    plugins.display_latency.DisplayLatency correlates the control camera pixel sum with.
+    """
+    description = 'Full screen binary luminance code for display latency measurement'
+
+    # Luminance of every rendered frame
+    luminance = vxvisual.FloatParameter('luminance', internal=True)
+
+    def __init__(self, *args, **kwargs):
+        vxvisual.PlainVisual.__init__(self, *args, **kwargs)
+
+        self.code = latency.LuminanceCode()
+
+    def initialize(self, *args, **kwargs):
+        pass
+
+    def render(self, dt):
+        luminance = self.code.luminance(vxipc.get_time())
+        self.luminance.data = luminance
+        gloo.clear((luminance,) * 3)